@@ -3,22 +3,48 @@ from typing import Union, List, Dict, Optional
 
 from pydantic import BaseModel
 
-from backend.llms import BaseLLM
+from backend.llms import BaseLLM, CancellationToken
 
 # * ==============================================================
 # * Base Agent
 # * ==============================================================
 
 class BaseAgent(ABC):
-    def __init__(self, llm: BaseLLM, system_prompt: str, **kwargs):
+    def __init__(self, llm: BaseLLM, system_prompt: str, timeout: Optional[float] = None, **kwargs):
         pass
 
-    def respond(self, messages: Union[str, List[Dict[str, str]]]) -> str:
+    def respond(self, messages: Union[str, List[Dict[str, str]]], 
+                cancel_token: Optional[CancellationToken] = None) -> str:
         pass
 
-    def structured_respond(self, messages: Union[str, List[Dict[str, str]]]) -> BaseModel:
+    def structured_respond(self, messages: Union[str, List[Dict[str, str]]], 
+                           cancel_token: Optional[CancellationToken] = None) -> BaseModel:
         pass
 
+    def _build_messages(self, messages: Union[str, List[Dict[str, str]]]) -> List[Dict[str, str]]:
+        """
+        Assemble the messages sent to the LLM, ordered for provider-side prompt caching.
+
+        The system prompt, identical for every student, comes first, followed by the
+        per-student modifier (if any) in its own system message and then the
+        conversation, which only grows between turns. Requests therefore share the
+        longest possible byte-identical prefix with earlier ones.
+
+        Args:
+            messages: Either a string message or a list of message dictionaries
+
+        Returns:
+            Messages for the LLM
+        """
+        message = [{"role": "system", "content": self.system_prompt_}]
+        if getattr(self, 'modifier_', ''):
+            message.append({"role": "system", "content": self.modifier_})
+        if isinstance(messages, str):
+            message.append({"role": "user", "content": messages})
+        else:
+            message += messages
+        return message
+
 # * ==============================================================
 # * Scenario Agent
 # * ==============================================================
@@ -64,16 +90,17 @@ def build_scenario_prompt(occupation: Optional[str] = None, topic: Optional[str]
         return SCENARIO_PROMPT.format(occupation=occupation, topic='')
 
 class ScenarioAgent(BaseAgent):
-    def __init__(self, llm: BaseLLM, system_prompt: str = SCENARIO_SYSTEM_PROMPT, **kwargs):
+    def __init__(self, llm: BaseLLM, system_prompt: str = SCENARIO_SYSTEM_PROMPT, timeout: Optional[float] = None, 
+                 modifier: str = '', **kwargs):
         self.llm_ = llm
         self.system_prompt_ = system_prompt
+        self.timeout_ = timeout
+        self.modifier_ = modifier
 
-    def respond(self, messages: Union[str, List[Dict[str, str]]]) -> str:
-        message = [
-            {"role": "system", "content": self.system_prompt_},
-            {"role": "user", "content": messages}
-        ]
-        return self.llm_.query(message)
+    def respond(self, messages: Union[str, List[Dict[str, str]]], 
+                cancel_token: Optional[CancellationToken] = None) -> str:
+        message = self._build_messages(messages)
+        return self.llm_.query(message, timeout=self.timeout_, cancel_token=cancel_token)
 
 
 # * ==============================================================
@@ -106,20 +133,17 @@ TONE:
 """
 
 class UserClarificationAgent(BaseAgent):
-    def __init__(self, llm: BaseLLM, system_prompt: str = USER_CLARIFICATION_SYSTEM_PROMPT, **kwargs):
+    def __init__(self, llm: BaseLLM, system_prompt: str = USER_CLARIFICATION_SYSTEM_PROMPT, timeout: Optional[float] = None, 
+                 modifier: str = '', **kwargs):
         self.llm_ = llm
         self.system_prompt_ = system_prompt
+        self.timeout_ = timeout
+        self.modifier_ = modifier
 
-    def respond(self, messages: Union[str, List[Dict[str, str]]]) -> str:
-        if isinstance(messages, str):
-            message = [
-                {"role": "system", "content": self.system_prompt_},
-                {"role": "user", "content": messages}
-            ]
-        else:
-            # Prepend system prompt to message list
-            message = [{"role": "system", "content": self.system_prompt_}] + messages
-        return self.llm_.query(message)
+    def respond(self, messages: Union[str, List[Dict[str, str]]], 
+                cancel_token: Optional[CancellationToken] = None) -> str:
+        message = self._build_messages(messages)
+        return self.llm_.query(message, timeout=self.timeout_, cancel_token=cancel_token)
 
 # * ==============================================================
 # * Scenario Clarification Agent
@@ -150,20 +174,17 @@ TONE:
 """
 
 class ScenarioClarificationAgent(BaseAgent):
-    def __init__(self, llm: BaseLLM, system_prompt: str = SCENARIO_CLARIFICATION_SYSTEM_PROMPT, **kwargs):
+    def __init__(self, llm: BaseLLM, system_prompt: str = SCENARIO_CLARIFICATION_SYSTEM_PROMPT, timeout: Optional[float] = None, 
+                 modifier: str = '', **kwargs):
         self.llm_ = llm
         self.system_prompt_ = system_prompt
+        self.timeout_ = timeout
+        self.modifier_ = modifier
 
-    def respond(self, messages: Union[str, List[Dict[str, str]]]) -> str:
-        if isinstance(messages, str):
-            message = [
-                {"role": "system", "content": self.system_prompt_},
-                {"role": "user", "content": messages}
-            ]
-        else:
-            # Prepend system prompt to message list
-            message = [{"role": "system", "content": self.system_prompt_}] + messages
-        return self.llm_.query(message)
+    def respond(self, messages: Union[str, List[Dict[str, str]]], 
+                cancel_token: Optional[CancellationToken] = None) -> str:
+        message = self._build_messages(messages)
+        return self.llm_.query(message, timeout=self.timeout_, cancel_token=cancel_token)
 
 # * ==============================================================
 # * Retort Agent
@@ -213,20 +234,17 @@ TONE:
 """
 
 class RetortAgent(BaseAgent):
-    def __init__(self, llm: BaseLLM, system_prompt: str = RETORT_SYSTEM_PROMPT, **kwargs):
+    def __init__(self, llm: BaseLLM, system_prompt: str = RETORT_SYSTEM_PROMPT, timeout: Optional[float] = None, 
+                 modifier: str = '', **kwargs):
         self.llm_ = llm
         self.system_prompt_ = system_prompt
+        self.timeout_ = timeout
+        self.modifier_ = modifier
 
-    def respond(self, messages: Union[str, List[Dict[str, str]]]) -> str:
-        if isinstance(messages, str):
-            message = [
-                {"role": "system", "content": self.system_prompt_},
-                {"role": "user", "content": messages}
-            ]
-        else:
-            # Prepend system prompt to message list
-            message = [{"role": "system", "content": self.system_prompt_}] + messages
-        return self.llm_.query(message)
+    def respond(self, messages: Union[str, List[Dict[str, str]]], 
+                cancel_token: Optional[CancellationToken] = None) -> str:
+        message = self._build_messages(messages)
+        return self.llm_.query(message, timeout=self.timeout_, cancel_token=cancel_token)
 
 # * ==============================================================
 # * Injection Attack Agent
@@ -248,20 +266,17 @@ You must:
 """
 
 class InjectionAttackAgent(BaseAgent):
-    def __init__(self, llm: BaseLLM, system_prompt: str = INJECTION_ATTACK_SYSTEM_PROMPT, **kwargs):
+    def __init__(self, llm: BaseLLM, system_prompt: str = INJECTION_ATTACK_SYSTEM_PROMPT, timeout: Optional[float] = None, 
+                 modifier: str = '', **kwargs):
         self.llm_ = llm
         self.system_prompt_ = system_prompt
+        self.timeout_ = timeout
+        self.modifier_ = modifier
 
-    def respond(self, messages: Union[str, List[Dict[str, str]]]) -> str:
-        if isinstance(messages, str):
-            message = [
-                {"role": "system", "content": self.system_prompt_},
-                {"role": "user", "content": messages}
-            ]
-        else:
-            # Prepend system prompt to message list
-            message = [{"role": "system", "content": self.system_prompt_}] + messages
-        return self.llm_.query(message)
+    def respond(self, messages: Union[str, List[Dict[str, str]]], 
+                cancel_token: Optional[CancellationToken] = None) -> str:
+        message = self._build_messages(messages)
+        return self.llm_.query(message, timeout=self.timeout_, cancel_token=cancel_token)
 
 # * ==============================================================
 # * Conductor Agent
@@ -284,6 +299,7 @@ You are a conductor agent responsible for routing user messages to the appropria
 
 YOUR TASK:
 Analyze the user's latest response in the conversation context and determine which agent should respond. You must select the most appropriate agent based on the user's message content and the conversation state.
+The conversation follows this message, oldest turn first; a summary may stand in for the earliest turns. The final message is the user's latest response, the one you are routing.
 
 AVAILABLE AGENTS:
 {agent_descriptions}
@@ -312,7 +328,8 @@ IMPORTANT:
 """
 
 class ConductorAgent(BaseAgent):
-    def __init__(self, llm: BaseLLM, agent_mapping: Optional[Dict[int, str]] = AGENT_MAPPING, system_prompt: Optional[str] = CONDUCTOR_SYSTEM_PROMPT, **kwargs):
+    def __init__(self, llm: BaseLLM, agent_mapping: Optional[Dict[int, str]] = AGENT_MAPPING, system_prompt: Optional[str] = CONDUCTOR_SYSTEM_PROMPT, 
+                 timeout: Optional[float] = None, **kwargs):
         """
         Initialize the ConductorAgent.
         
@@ -320,57 +337,216 @@ class ConductorAgent(BaseAgent):
             llm: The language model to use for structured queries
             agent_mapping: Dictionary mapping agent_id (int) to agent description (str). 
                           Defaults to AGENT_MAPPING if None.
-            system_prompt: Optional custom system prompt (uses default if None)
+            system_prompt: Optional custom system prompt template (uses default if None). 
+                           '{agent_descriptions}' is replaced with the agent mapping.
+            timeout: Optional deadline in seconds for the routing call
         """
         self.llm_ = llm
+        self.timeout_ = timeout
         self.agent_mapping_ = agent_mapping if agent_mapping is not None else AGENT_MAPPING
         
         # Build agent descriptions string from mapping
         agent_descriptions = "\n".join([f"  - Agent ID {agent_id}: {description}" 
-                                        for agent_id, description in sorted(agent_mapping.items())])
+                                        for agent_id, description in sorted(self.agent_mapping_.items())])
         
+        # Prompts are templates: fill in the agent descriptions wherever they are referenced
         if system_prompt is None:
-            self.system_prompt_ = CONDUCTOR_SYSTEM_PROMPT.format(agent_descriptions=agent_descriptions)
-        else:
-            self.system_prompt_ = system_prompt
+            system_prompt = CONDUCTOR_SYSTEM_PROMPT
+        self.system_prompt_ = system_prompt.replace("{agent_descriptions}", agent_descriptions)
 
-    def select_agent(self, messages: Union[str, List[Dict[str, str]]]) -> int:
+    def select_agent(self, messages: Union[str, List[Dict[str, str]]], 
+                     cancel_token: Optional[CancellationToken] = None) -> int:
         """
         Select which agent should respond to the user's message.
+
+        The conversation is sent as messages after the system prompt rather than
+        folded into a new string, ending with the user's latest message, so
+        consecutive routing calls in a debate share their prefix for provider-side
+        prompt caching.
         
         Args:
             messages: Either a string message or a list of message dictionaries
+            cancel_token: Optional token used to abandon the routing call
             
         Returns:
             The agent_id (int) of the selected agent
         """
-        # Format messages as a prompt string
+        message = [{"role": "system", "content": self.system_prompt_}]
         if isinstance(messages, str):
-            prompt = f"User's latest message: {messages}"
+            message.append({"role": "user", "content": messages})
         else:
-            # Extract the conversation history and format it
-            conversation_parts = []
             for msg in messages:
                 role = msg.get("role", "unknown")
                 content = msg.get("content", "")
-                if role.lower() != "system":  # Exclude system messages from the prompt
-                    conversation_parts.append(f"{role.capitalize()}: {content}")
-            
-            if conversation_parts:
-                prompt = "Conversation history:\n" + "\n".join(conversation_parts)
-                # Get the latest user message
-                user_messages = [msg.get("content", "") for msg in messages 
-                               if msg.get("role", "").lower() == "user"]
-                if user_messages:
-                    prompt += f"\n\nUser's latest message: {user_messages[-1]}"
-            else:
-                prompt = "User's latest message: " + (messages[-1].get("content", "") if messages else "")
+                if msg.get("name") == DEBATE_SUMMARY_NAME:  # Keep the rolling summary of earlier turns
+                    message.append({"role": "system", "content": f"Summary of earlier debate: {content}"})
+                elif role.lower() != "system":  # Exclude other system messages
+                    message.append({"role": role, "content": content})
         
         # Use structured query to get agent selection
         response = self.llm_.structured_query(
             response_format=AgentSelection,
-            prompt=prompt,
-            system_prompt=self.system_prompt_
+            prompt=message,
+            timeout=self.timeout_,
+            cancel_token=cancel_token
         )
         
         return response.agent_id
+
+# * ==============================================================
+# * Summary Agent
+# * ==============================================================
+
+# Name attached to the message carrying the rolling debate summary
+DEBATE_SUMMARY_NAME = "debate_summary"
+
+SUMMARY_SYSTEM_PROMPT = """OBJECTIVE:
+You maintain the running memory of an ethics debate between a student and an AI opponent. The memory replaces the older turns of the conversation, so anything you leave out is forgotten.
+
+YOUR TASK:
+You are given the current memory (which may be empty) and the next turns of the debate. Rewrite the memory so it also covers the new turns.
+
+GUIDELINES:
+  - Record the student's position, each argument and piece of evidence they offered, and any concessions or changes of position
+  - Record the counterarguments the opponent raised and whether the student answered them
+  - Record any clarifying facts added to the scenario and any warnings given to the student
+  - Keep the order in which points were made
+  - Do not restate the scenario itself, it is always provided separately
+
+LENGTH:
+  - Use terse bullet points
+  - Keep the memory under 300 words, merging or dropping minor points first
+
+TONE:
+  - Neutral and factual, with no evaluation of who is winning
+"""
+
+class SummaryAgent(BaseAgent):
+    def __init__(self, llm: BaseLLM, system_prompt: str = SUMMARY_SYSTEM_PROMPT, timeout: Optional[float] = None, **kwargs):
+        self.llm_ = llm
+        self.system_prompt_ = system_prompt
+        self.timeout_ = timeout
+
+    def respond(self, messages: Union[str, List[Dict[str, str]]], summary: Optional[str] = None,
+                cancel_token: Optional[CancellationToken] = None) -> str:
+        """
+        Fold new debate turns into the running summary.
+
+        Args:
+            messages: The turns not yet covered by the summary
+            summary: The current summary, if any
+            cancel_token: Optional token used to abandon the call
+
+        Returns:
+            The updated summary
+        """
+        if isinstance(messages, str):
+            turns = messages
+        else:
+            turns = "\n\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in messages)
+        prompt = f"CURRENT MEMORY:\n{summary or '(empty)'}\n\nNEW TURNS:\n{turns}"
+        message = [
+            {"role": "system", "content": self.system_prompt_},
+            {"role": "user", "content": prompt}
+        ]
+        return self.llm_.query(message, timeout=self.timeout_, cancel_token=cancel_token)
+
+# * ==============================================================
+# * Rubric Agent
+# * ==============================================================
+
+# Criteria used to grade a debate, each scored from RUBRIC_SCALE[0] to RUBRIC_SCALE[1]
+RUBRIC = {
+    'position': "States a clear decision on the dilemma and keeps to it, or explains any change of position.",
+    'reasoning': "Supports the position with coherent reasoning, concrete examples and evidence.",
+    'counterarguments': "Engages directly with the opponent's counterarguments instead of ignoring or deflecting them.",
+    'scenario': "Uses the specific details and stakeholders of the scenario rather than generic arguments.",
+    'ethics': "Applies ethical principles or frameworks and weighs the competing values at stake.",
+}
+RUBRIC_SCALE = (1, 5)
+
+RUBRIC_SYSTEM_PROMPT = """OBJECTIVE:
+You are grading a student's performance in an ethics debate against an AI opponent ("EthicsBot"). You are given the scenario, possibly a summary of the earlier debate, and the transcript of the debate.
+
+RUBRIC:
+{rubric}
+
+INSTRUCTIONS:
+  - Grade only the student's messages; EthicsBot's messages are context
+  - Score every criterion from {low} (poor) to {high} (excellent), using the criterion names exactly as given
+  - Justify each score in one sentence that cites what the student said
+  - Finish with two or three sentences of overall feedback addressed to the student
+
+TONE:
+  - Fair, specific and constructive
+"""
+
+class CriterionScore(BaseModel):
+    """Score of a single rubric criterion."""
+    criterion: str
+    score: int
+    justification: str
+
+class RubricScore(BaseModel):
+    """Response model for rubric grading."""
+    scores: List[CriterionScore]
+    feedback: str
+
+class RubricAgent(BaseAgent):
+    def __init__(self, llm: BaseLLM, rubric: Dict[str, str] = RUBRIC, system_prompt: str = RUBRIC_SYSTEM_PROMPT, 
+                 timeout: Optional[float] = None, **kwargs):
+        """
+        Initialize the RubricAgent.
+
+        Args:
+            llm: The language model to use for structured queries
+            rubric: Dictionary mapping criterion name to its description
+            system_prompt: System prompt template. '{rubric}', '{low}' and '{high}' are
+                           replaced with the rubric and the ends of RUBRIC_SCALE.
+            timeout: Optional deadline in seconds for the grading call
+        """
+        self.llm_ = llm
+        self.rubric_ = rubric
+        self.timeout_ = timeout
+        criteria = "\n".join(f"  - {name}: {description}" for name, description in rubric.items())
+        self.system_prompt_ = (system_prompt.replace("{rubric}", criteria)
+                               .replace("{low}", str(RUBRIC_SCALE[0])).replace("{high}", str(RUBRIC_SCALE[1])))
+
+    def structured_respond(self, messages: Union[str, List[Dict[str, str]]], scenario: Optional[str] = None,
+                           summary: Optional[str] = None,
+                           cancel_token: Optional[CancellationToken] = None) -> RubricScore:
+        """
+        Grade a debate transcript against the rubric.
+
+        Args:
+            messages: The debate turns to grade (without the scenario)
+            scenario: The scenario the debate is about
+            summary: Summary of earlier turns not included in messages, if any
+            cancel_token: Optional token used to abandon the call
+
+        Returns:
+            Scores clamped to RUBRIC_SCALE and overall feedback
+        """
+        if isinstance(messages, str):
+            turns = messages
+        else:
+            turns = "\n\n".join(f"{'Student' if m['role'] == 'user' else 'EthicsBot'}: {m['content']}" 
+                                for m in messages if m['role'] != 'system')
+        prompt = f"SCENARIO:\n{scenario or '(not provided)'}\n\n"
+        if summary:
+            prompt += f"SUMMARY OF EARLIER DEBATE:\n{summary}\n\n"
+        prompt += f"TRANSCRIPT:\n{turns}"
+        message = [
+            {"role": "system", "content": self.system_prompt_},
+            {"role": "user", "content": prompt}
+        ]
+        response = self.llm_.structured_query(
+            response_format=RubricScore,
+            prompt=message,
+            timeout=self.timeout_,
+            cancel_token=cancel_token
+        )
+        low, high = RUBRIC_SCALE
+        for score in response.scores:
+            score.score = min(high, max(low, score.score))
+        return response
@@ -0,0 +1,311 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# * ==============================================================
+# * Constants
+# * ==============================================================
+
+# One row per message, with the session metadata of the export it came from
+MESSAGE_SCHEMA = pa.schema([
+    ('source_file', pa.string()),
+    ('batch', pa.int64()),
+    ('username', pa.string()),
+    ('occupation', pa.string()),
+    ('topic', pa.string()),
+    ('start_time', pa.float64()),
+    ('end_time', pa.float64()),
+    ('message_index', pa.int32()),
+    ('role', pa.string()),
+    ('content', pa.string()),
+    ('content_length', pa.int32()),
+    ('agent', pa.string()),
+])
+
+MESSAGES_DIR = 'messages'
+MANIFEST_FILE = 'manifest.json'
+
+# Number of export files handed to a worker process at a time
+CHUNK_SIZE = 16
+
+# * ==============================================================
+# * Parsing
+# * ==============================================================
+
+def scan_exports(export_dir: str) -> List[str]:
+    """
+    Find every D2L export (*.json) below a directory.
+
+    Paths are made absolute with symlinks resolved, so they identify an export
+    however the directory was named (e.g. 'ex', './ex' or '/tmp/ex').
+
+    Args:
+        export_dir: Directory holding exported transcripts
+
+    Returns:
+        Sorted list of normalized export file paths
+    """
+    paths = []
+    for root, dirs, files in os.walk(export_dir):
+        paths.extend(os.path.realpath(os.path.join(root, f)) for f in files if f.lower().endswith('.json'))
+    return sorted(paths)
+
+def parse_export(path: str) -> Tuple[str, Optional[Dict[str, List[Any]]], Optional[str]]:
+    """
+    Normalize one D2L export into message columns.
+
+    Args:
+        path: Path to the export produced by the app's "Download D2L File" button
+
+    Returns:
+        The path, a dictionary of columns matching MESSAGE_SCHEMA (without
+        'source_file' and 'batch') or None, and an error message or None
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            export = json.load(f)
+        messages = export.get('messages') or []
+        # Older exports have no agent list; newer ones align it with messages
+        agents = export.get('agents') or [None] * len(messages)
+        if len(agents) != len(messages):
+            agents = [None] * len(messages)
+
+        n = len(messages)
+        contents = [m.get('content') or '' for m in messages]
+        columns = {
+            'username': [export.get('username')] * n,
+            'occupation': [export.get('occupation') or None] * n,
+            'topic': [export.get('topic') or None] * n,
+            'start_time': [export.get('start_time')] * n,
+            'end_time': [export.get('end_time')] * n,
+            'message_index': list(range(n)),
+            'role': [m.get('role') for m in messages],
+            'content': contents,
+            'content_length': [len(c) for c in contents],
+            'agent': agents,
+        }
+    except (OSError, ValueError, AttributeError, TypeError) as e:
+        # Malformed exports are reported, never allowed to abort the batch
+        return path, None, f"{type(e).__name__}: {e}"
+    return path, columns, None
+
+# * ==============================================================
+# * Ingestion
+# * ==============================================================
+
+def _fingerprint(path: str) -> List[float]:
+    stat = os.stat(path)
+    return [stat.st_mtime, stat.st_size]
+
+def load_manifest(out_dir: str) -> Dict[str, Any]:
+    """
+    Load the record of already ingested exports.
+
+    Args:
+        out_dir: Output directory of the pipeline
+
+    Returns:
+        Mapping of normalized export path (see scan_exports) to its fingerprint,
+        batch and optional error
+    """
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        # Manifests written before paths were normalized may hold relative paths
+        return {os.path.realpath(p): entry for p, entry in json.load(f).items()}
+
+def ingest(export_dir: str, out_dir: str, workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Incrementally normalize a directory of D2L exports into a Parquet dataset.
+
+    Only exports that are new, or whose modification time or size changed since
+    the last run, are parsed. They are parsed in parallel across processes and
+    written as a single new Parquet part tagged with a batch id. When an export is
+    re-ingested, readers keep only its latest batch (see load_messages).
+
+    Args:
+        export_dir: Directory holding exported transcripts
+        out_dir: Directory receiving the Parquet dataset and manifest
+        workers: Number of worker processes (defaults to the CPU count)
+
+    Returns:
+        Summary with the number of files scanned, ingested, skipped and failed,
+        the number of rows written and any parse errors
+    """
+    os.makedirs(os.path.join(out_dir, MESSAGES_DIR), exist_ok=True)
+    manifest = load_manifest(out_dir)
+    paths = scan_exports(export_dir)
+    pending = [p for p in paths if manifest.get(p, {}).get('fingerprint') != _fingerprint(p)]
+
+    batch = time.time_ns()
+    columns: Dict[str, List[Any]] = {name: [] for name in MESSAGE_SCHEMA.names}
+    errors = {}
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, parsed, error in pool.map(parse_export, pending, chunksize=CHUNK_SIZE):
+                manifest[path] = {'fingerprint': _fingerprint(path), 'batch': batch, 'error': error}
+                if error is not None:
+                    errors[path] = error
+                    continue
+                n = len(parsed['role'])
+                columns['source_file'].extend([path] * n)
+                columns['batch'].extend([batch] * n)
+                for name, values in parsed.items():
+                    columns[name].extend(values)
+
+    rows = len(columns['source_file'])
+    if rows:
+        table = pa.Table.from_pydict(columns, schema=MESSAGE_SCHEMA)
+        pq.write_table(table, os.path.join(out_dir, MESSAGES_DIR, f'part-{batch}.parquet'))
+
+    # Write the manifest last so an interrupted run is simply redone
+    with open(os.path.join(out_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    return {
+        'scanned': len(paths),
+        'ingested': len(pending) - len(errors),
+        'skipped': len(paths) - len(pending),
+        'failed': len(errors),
+        'rows': rows,
+        'errors': errors,
+    }
+
+def load_messages(out_dir: str) -> pa.Table:
+    """
+    Read the message dataset, keeping only the latest batch of each export.
+
+    Args:
+        out_dir: Output directory of the pipeline
+
+    Returns:
+        Table with one row per message
+    """
+    messages_dir = os.path.join(out_dir, MESSAGES_DIR)
+    if not os.path.isdir(messages_dir) or not os.listdir(messages_dir):
+        return MESSAGE_SCHEMA.empty_table()
+    table = ds.dataset(messages_dir, format='parquet', schema=MESSAGE_SCHEMA).to_table()
+    latest = table.group_by('source_file').aggregate([('batch', 'max')])
+    table = table.join(latest, keys=['source_file', 'batch'], right_keys=['source_file', 'batch_max'],
+                       join_type='left semi')
+    return table.sort_by([('source_file', 'ascending'), ('message_index', 'ascending')])
+
+# * ==============================================================
+# * Statistics
+# * ==============================================================
+
+def session_stats(messages: pa.Table) -> pd.DataFrame:
+    """
+    Compute per-session statistics.
+
+    Args:
+        messages: Table returned by load_messages
+
+    Returns:
+        One row per export with the student, turn and message counts, the
+        session duration in minutes and message lengths by role
+    """
+    is_user = pc.equal(messages['role'], 'user')
+    is_assistant = pc.equal(messages['role'], 'assistant')
+    table = messages.append_column('is_user', pc.cast(is_user, pa.int32()))
+    table = table.append_column('is_assistant', pc.cast(is_assistant, pa.int32()))
+    table = table.append_column('user_length', pc.if_else(is_user, table['content_length'], None))
+    table = table.append_column('assistant_length', pc.if_else(is_assistant, table['content_length'], None))
+
+    stats = table.group_by(['source_file', 'username', 'occupation', 'topic', 'start_time', 'end_time']).aggregate([
+        ('message_index', 'count'),
+        ('is_user', 'sum'),
+        ('is_assistant', 'sum'),
+        ('user_length', 'mean'),
+        ('user_length', 'max'),
+        ('assistant_length', 'mean'),
+    ]).to_pandas()
+    stats = stats.rename(columns={
+        'message_index_count': 'messages',
+        'is_user_sum': 'turns',
+        'is_assistant_sum': 'assistant_messages',
+        'user_length_mean': 'mean_user_length',
+        'user_length_max': 'max_user_length',
+        'assistant_length_mean': 'mean_assistant_length',
+    })
+    stats['duration_min'] = (stats['end_time'] - stats['start_time']) / 60
+    return stats.sort_values('source_file').reset_index(drop=True)
+
+def agent_mix(messages: pa.Table) -> pd.DataFrame:
+    """
+    Count assistant messages by the agent that produced them.
+
+    Only exports that record their agents contribute.
+
+    Args:
+        messages: Table returned by load_messages
+
+    Returns:
+        One row per agent with its message count and share
+    """
+    agents = pc.drop_null(messages['agent'])
+    if len(agents) == 0:
+        return pd.DataFrame(columns=['agent', 'messages', 'share'])
+    counts = pc.value_counts(agents).to_pandas()
+    mix = pd.DataFrame({'agent': [c['values'] for c in counts], 'messages': [c['counts'] for c in counts]})
+    mix['share'] = mix['messages'] / mix['messages'].sum()
+    return mix.sort_values('messages', ascending=False).reset_index(drop=True)
+
+def summary(messages: pa.Table) -> Dict[str, Any]:
+    """
+    Compute course-wide statistics.
+
+    Args:
+        messages: Table returned by load_messages
+
+    Returns:
+        Dictionary with session, student and message counts and the mean and
+        percentile turn counts, durations and message lengths
+    """
+    sessions = session_stats(messages)
+    user_lengths = pc.filter(messages['content_length'], pc.equal(messages['role'], 'user'))
+    return {
+        'sessions': len(sessions),
+        'students': int(sessions['username'].nunique()),
+        'messages': messages.num_rows,
+        'turns_mean': float(sessions['turns'].mean()) if len(sessions) else 0.0,
+        'turns_p50': float(sessions['turns'].median()) if len(sessions) else 0.0,
+        'duration_min_mean': float(sessions['duration_min'].mean()) if len(sessions) else 0.0,
+        'duration_min_p90': float(sessions['duration_min'].quantile(0.9)) if len(sessions) else 0.0,
+        'user_length_mean': float(pc.mean(user_lengths).as_py() or 0.0),
+        'user_length_p90': float(pc.quantile(user_lengths, q=0.9)[0].as_py() or 0.0) if len(user_lengths) else 0.0,
+    }
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ingest D2L exports into Parquet and report statistics.')
+    parser.add_argument('export_dir', help='Directory holding exported transcripts')
+    parser.add_argument('out_dir', help='Directory receiving the Parquet dataset')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--sessions-csv', help='Optional path to write per-session statistics')
+    args = parser.parse_args()
+
+    result = ingest(args.export_dir, args.out_dir, workers=args.workers)
+    print(f"Scanned {result['scanned']} exports: {result['ingested']} ingested, "
+          f"{result['skipped']} unchanged, {result['failed']} failed, {result['rows']} rows written")
+    for path, error in result['errors'].items():
+        print(f"  {path}: {error}")
+
+    messages = load_messages(args.out_dir)
+    for key, value in summary(messages).items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+    mix = agent_mix(messages)
+    if len(mix):
+        print(mix.to_string(index=False))
+    if args.sessions_csv:
+        session_stats(messages).to_csv(args.sessions_csv, index=False)
@@ -0,0 +1,335 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Type, Union
+
+from pydantic import BaseModel
+
+from backend.llms import BaseLLM, OpenAILLM, CancellationToken
+
+# * ==============================================================
+# * Constants
+# * ==============================================================
+
+MODES = ('record', 'replay')
+MATCHING = ('strict', 'lenient')
+LATENCIES = ('zero', 'original')
+
+# * ==============================================================
+# * Cassette
+# * ==============================================================
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when no recorded interaction matches a request."""
+    pass
+
+def _normalize(prompt: Union[str, List[Dict[str, str]]], system_prompt: Optional[str]) -> List[Dict[str, str]]:
+    """Build the message list the request resolves to, mirroring OpenAILLM._build_message."""
+    if isinstance(prompt, str):
+        return [
+            {"role": "system", "content": system_prompt if system_prompt is not None else "You are a helpful AI assistant."},
+            {"role": "user", "content": prompt}
+        ]
+    return [dict(m) for m in prompt]
+
+def request_key(method: str, messages: List[Dict[str, str]], response_format: Optional[str] = None) -> str:
+    """
+    Return the identifier used to match a request in strict mode.
+
+    Args:
+        method: 'query' or 'structured_query'
+        messages: The normalized messages of the request
+        response_format: Name of the structured response model, if any
+
+    Returns:
+        Hex digest of the request
+    """
+    payload = json.dumps([method, response_format, messages], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def system_key(messages: List[Dict[str, str]]) -> str:
+    """
+    Return the identifier of the system prompt a request opens with.
+
+    The per-student modifier travels in its own, later system message, so requests
+    from one agent share this identifier regardless of the student.
+
+    Args:
+        messages: The normalized messages of the request
+
+    Returns:
+        Hex digest of the leading system message ('' when there is none)
+    """
+    if not messages or messages[0].get('role') != 'system':
+        return ''
+    return hashlib.sha256((messages[0].get('content') or '').encode()).hexdigest()
+
+class Cassette:
+    """
+    A file of recorded LLM interactions.
+
+    Interactions are stored one per line as compact JSON, gzip compressed when the
+    path ends in '.gz'. Each holds the method, the request key, the normalized
+    messages, the response (text, or the response model's name and fields) and the
+    original latency. Several CassetteLLMs may share one cassette.
+
+    Matching in replay mode:
+        strict: the request must match a recording exactly (same method, response
+                model and messages). Identical requests are served in recorded order.
+        lenient: falls back to the next unused recording of the same method,
+                 response model and system prompt (i.e. the same agent) when there
+                 is no exact match, so replays survive per-student modifiers and
+                 changed user text. Edited system prompts need re-recording.
+
+    Attributes:
+        path_: Location of the cassette file
+        mode_: 'record' or 'replay'
+        matching_: 'strict' or 'lenient'
+    """
+
+    def __init__(self, path: str, mode: str = 'replay', matching: str = 'strict') -> None:
+        """
+        Open a cassette.
+
+        Args:
+            path: Location of the cassette file
+            mode: 'record' appends new interactions, 'replay' serves recorded ones
+            matching: 'strict' or 'lenient' request matching in replay mode
+
+        Raises:
+            ValueError: If the mode or matching is not supported
+            FileNotFoundError: If replaying a cassette that does not exist
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}.")
+        if matching not in MATCHING:
+            raise ValueError(f"matching must be one of {MATCHING}.")
+        self.path_ = path
+        self.mode_ = mode
+        self.matching_ = matching
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, Deque[int]] = defaultdict(deque)
+        self._by_kind: Dict[tuple, Deque[int]] = defaultdict(deque)
+        self._used: set = set()
+        self.interactions_: List[Dict[str, Any]] = []
+        if mode == 'replay':
+            self._load()
+
+    def _open(self, mode: str):
+        if self.path_.endswith('.gz'):
+            return gzip.open(self.path_, mode + 't', encoding='utf-8')
+        return open(self.path_, mode, encoding='utf-8')
+
+    def _load(self) -> None:
+        with self._open('r') as f:
+            for line in f:
+                if line.strip():
+                    self.interactions_.append(json.loads(line))
+        for i, interaction in enumerate(self.interactions_):
+            self._by_key[interaction['key']].append(i)
+            self._by_kind[(interaction['method'], interaction.get('format'),
+                           system_key(interaction.get('messages') or []))].append(i)
+
+    def record(self, interaction: Dict[str, Any]) -> None:
+        """
+        Append an interaction to the cassette file.
+
+        Args:
+            interaction: The interaction to store
+        """
+        with self._lock:
+            self.interactions_.append(interaction)
+            directory = os.path.dirname(self.path_)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._open('a') as f:
+                f.write(json.dumps(interaction, separators=(',', ':')) + '\n')
+
+    def _next_unused(self, queue: Deque[int]) -> Optional[int]:
+        while queue and queue[0] in self._used:
+            queue.popleft()
+        return queue.popleft() if queue else None
+
+    def match(self, method: str, key: str, response_format: Optional[str], system: str = '') -> Dict[str, Any]:
+        """
+        Find the recorded interaction serving a request.
+
+        Args:
+            method: 'query' or 'structured_query'
+            key: The request key (see request_key)
+            response_format: Name of the structured response model, if any
+            system: The request's system prompt key (see system_key), used by lenient matching
+
+        Returns:
+            The recorded interaction
+
+        Raises:
+            CassetteMissError: If nothing matches
+        """
+        with self._lock:
+            index = self._next_unused(self._by_key[key])
+            if index is None and self.matching_ == 'lenient':
+                index = self._next_unused(self._by_kind[(method, response_format, system)])
+            if index is None:
+                raise CassetteMissError(f"No recorded {method} interaction matches request {key[:12]} "
+                                        f"in {self.path_} ({self.matching_} matching).")
+            self._used.add(index)
+            return self.interactions_[index]
+
+# * ==============================================================
+# * Cassette LLM
+# * ==============================================================
+
+class CassetteLLM(BaseLLM):
+    """
+    Record/replay wrapper around any BaseLLM.
+
+    In record mode every query and structured_query is forwarded to the wrapped
+    LLM and written to the cassette, including the parsed structured response (e.g.
+    the conductor's AgentSelection). In replay mode recorded responses are served
+    without a wrapped LLM or network access, either instantly or with the original
+    latency, so tests and profiling runs are fast and deterministic.
+
+    Attributes:
+        cassette_: The cassette interactions are recorded to or replayed from
+        llm_: The wrapped LLM (only needed in record mode)
+        latency_: 'zero' or 'original' replay latency
+        stats_: Counters for calls, replayed hits and recorded interactions
+    """
+
+    def __init__(self, cassette: Cassette, llm: Optional[BaseLLM] = None, latency: str = 'zero',
+                 **kwargs) -> None:
+        """
+        Initialize the wrapper.
+
+        Args:
+            cassette: The cassette to record to or replay from
+            llm: The LLM to record. Required in record mode.
+            latency: 'zero' to replay instantly, 'original' to replay with recorded latency
+            **kwargs: Additional arguments
+
+        Raises:
+            ValueError: If recording without an LLM or latency is not supported
+        """
+        if cassette.mode_ == 'record' and llm is None:
+            raise ValueError("An llm must be provided to record a cassette.")
+        if latency not in LATENCIES:
+            raise ValueError(f"latency must be one of {LATENCIES}.")
+        self.cassette_ = cassette
+        self.llm_ = llm
+        self.latency_ = latency
+        self.model_args_ = getattr(llm, 'model_args_', {})
+        self.stats_ = {'calls': 0, 'replayed': 0, 'recorded': 0}
+        self._stats_lock = threading.Lock()
+        self._usage = threading.local()
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats_[key] += 1
+
+    def _replay(self, method: str, messages: List[Dict[str, str]], response_format: Optional[str],
+                cancel_token: Optional[CancellationToken]) -> Dict[str, Any]:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        interaction = self.cassette_.match(method, request_key(method, messages, response_format), response_format,
+                                           system_key(messages))
+        if self.latency_ == 'original':
+            if cancel_token is None:
+                time.sleep(interaction['latency'])
+            elif cancel_token.wait(interaction['latency']):
+                cancel_token.raise_if_cancelled()
+        self._count('replayed')
+        self._usage.value = interaction.get('usage')
+        return interaction
+
+    def _record(self, method: str, messages: List[Dict[str, str]], response_format: Optional[str],
+                response: Any, latency: float) -> None:
+        self.cassette_.record({
+            'method': method,
+            'key': request_key(method, messages, response_format),
+            'format': response_format,
+            'model': self.model_args_.get('model'),
+            'messages': messages,
+            'response': response,
+            'latency': round(latency, 4),
+            'usage': self.llm_.last_usage(),
+        })
+        self._count('recorded')
+
+    def query(self, prompt: str, system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+              cancel_token: Optional[CancellationToken] = None) -> str:
+        """
+        Record or replay a text query.
+
+        Args:
+            prompt: The user's prompt
+            system_prompt: System prompt to set context
+            timeout: Optional deadline in seconds (forwarded when recording)
+            cancel_token: Optional token used to abandon the call
+
+        Returns:
+            The model's (or the recorded) response text
+
+        Raises:
+            CassetteMissError: If replaying and no recording matches
+        """
+        self._count('calls')
+        messages = _normalize(prompt, system_prompt)
+        if self.cassette_.mode_ == 'replay':
+            return self._replay('query', messages, None, cancel_token)['response']
+        start = time.perf_counter()
+        response = self.llm_.query(prompt, system_prompt, timeout=timeout, cancel_token=cancel_token)
+        self._usage.value = self.llm_.last_usage()
+        self._record('query', messages, None, response, time.perf_counter() - start)
+        return response
+
+    def structured_query(self, response_format: Type[BaseModel], prompt: str,
+                         system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+                         cancel_token: Optional[CancellationToken] = None) -> BaseModel:
+        """
+        Record or replay a structured query.
+
+        Args:
+            response_format: Pydantic model defining the expected response structure
+            prompt: The user's prompt
+            system_prompt: System prompt to set context
+            timeout: Optional deadline in seconds (forwarded when recording)
+            cancel_token: Optional token used to abandon the call
+
+        Returns:
+            The model's (or the recorded) response parsed into response_format
+
+        Raises:
+            CassetteMissError: If replaying and no recording matches
+        """
+        self._count('calls')
+        messages = _normalize(prompt, system_prompt)
+        name = response_format.__name__
+        if self.cassette_.mode_ == 'replay':
+            return response_format.model_validate(self._replay('structured_query', messages, name, cancel_token)['response'])
+        start = time.perf_counter()
+        response = self.llm_.structured_query(response_format, prompt, system_prompt,
+                                              timeout=timeout, cancel_token=cancel_token)
+        self._usage.value = self.llm_.last_usage()
+        self._record('structured_query', messages, name, response.model_dump(), time.perf_counter() - start)
+        return response
+
+def cassette_factory(cassette: Cassette, latency: str = 'zero'):
+    """
+    Build an LLM factory for AgentService that records to or replays from a cassette.
+
+    Args:
+        cassette: The cassette shared by every LLM the factory creates
+        latency: 'zero' or 'original' replay latency
+
+    Returns:
+        Callable taking an API key and model args and returning a CassetteLLM
+    """
+    def factory(api_key: str, model_args: Dict[str, Any]) -> CassetteLLM:
+        llm = OpenAILLM(api_key=api_key, model_args=model_args) if cassette.mode_ == 'record' else None
+        return CassetteLLM(cassette, llm=llm, latency=latency)
+    return factory
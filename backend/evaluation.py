@@ -0,0 +1,215 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from backend.llms import BaseLLM
+from backend.agents import AGENT_MAPPING, CONDUCTOR_SYSTEM_PROMPT, ConductorAgent
+from backend.service import AGENT_TIMEOUTS
+
+# * ==============================================================
+# * Constants
+# * ==============================================================
+
+DEFAULT_WORKERS = 8
+
+# Routing calls made by the app are bounded by the same deadline
+DEFAULT_TIMEOUT = AGENT_TIMEOUTS['ConductorAgent']
+
+# * ==============================================================
+# * Dataset
+# * ==============================================================
+
+def load_dataset(path: str) -> List[Dict[str, Any]]:
+    """
+    Load a labeled routing dataset.
+
+    The file holds one JSON object per line with 'messages' (a conversation prefix
+    ending in the student's message, or a single message string) and
+    'expected_agent_id' (a key of AGENT_MAPPING). An optional 'id' names the example.
+
+    Args:
+        path: Path to the JSON lines dataset
+
+    Returns:
+        List of examples, each with an 'id'
+
+    Raises:
+        ValueError: If an example is missing a field
+    """
+    examples = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            example = json.loads(line)
+            if 'messages' not in example or 'expected_agent_id' not in example:
+                raise ValueError(f"Line {line_number} must have 'messages' and 'expected_agent_id'.")
+            example.setdefault('id', str(line_number))
+            examples.append(example)
+    return examples
+
+# * ==============================================================
+# * Evaluation
+# * ==============================================================
+
+def _route(llm: BaseLLM, system_prompt: str, agent_mapping: Dict[int, str],
+           messages: Union[str, List[Dict[str, str]]], timeout: Optional[float]) -> Dict[str, Any]:
+    """
+    Run one routing call and measure it. Token usage is only reported for calls
+    that succeeded, since a failed call leaves the previous call's usage behind.
+    """
+    conductor_agent = ConductorAgent(llm=llm, agent_mapping=agent_mapping, system_prompt=system_prompt, timeout=timeout)
+    start = time.perf_counter()
+    try:
+        predicted, error = conductor_agent.select_agent(messages=messages), None
+    except Exception as e:
+        predicted, error = None, f"{type(e).__name__}: {e}"
+    latency = time.perf_counter() - start
+    usage = (llm.last_usage() or {}) if error is None else {}
+    return {
+        'predicted': predicted,
+        'error': error,
+        'latency': latency,
+        'prompt_tokens': usage.get('prompt_tokens'),
+        'completion_tokens': usage.get('completion_tokens'),
+        'cached_tokens': usage.get('cached_tokens'),
+    }
+
+def evaluate_routing(examples: List[Dict[str, Any]], llms: Dict[str, BaseLLM],
+                     prompt_variants: Optional[Dict[str, str]] = None,
+                     agent_mapping: Dict[int, str] = AGENT_MAPPING, workers: int = DEFAULT_WORKERS,
+                     timeout: Optional[float] = DEFAULT_TIMEOUT) -> pd.DataFrame:
+    """
+    Route every example with every model and prompt variant on a bounded thread pool.
+
+    Args:
+        examples: Labeled examples (see load_dataset)
+        llms: LLMs to evaluate, keyed by the name used in the report
+        prompt_variants: Conductor system prompt templates keyed by name. Defaults to
+                         CONDUCTOR_SYSTEM_PROMPT as 'default'.
+        agent_mapping: Agent descriptions given to the conductor
+        workers: Maximum number of routing calls in flight
+        timeout: Deadline in seconds for each routing call
+
+    Returns:
+        One row per (model, variant, example) with the expected and predicted agent,
+        any error, the latency in seconds and the token usage
+    """
+    if prompt_variants is None:
+        prompt_variants = {'default': CONDUCTOR_SYSTEM_PROMPT}
+
+    jobs = [(model, variant, example) for model in llms for variant in prompt_variants for example in examples]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(
+            lambda job: _route(llms[job[0]], prompt_variants[job[1]], agent_mapping, job[2]['messages'], timeout),
+            jobs))
+
+    rows = []
+    for (model, variant, example), result in zip(jobs, results):
+        rows.append({
+            'model': model,
+            'variant': variant,
+            'example_id': example['id'],
+            'expected': example['expected_agent_id'],
+            **result,
+        })
+    results = pd.DataFrame(rows)
+    results['correct'] = results['predicted'] == results['expected']
+    return results
+
+# * ==============================================================
+# * Reporting
+# * ==============================================================
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregate evaluation results per model and prompt variant.
+
+    Args:
+        results: Frame returned by evaluate_routing
+
+    Returns:
+        One row per (model, variant) with accuracy, error count, p50/p95 latency in
+        milliseconds, mean and p95 prompt/completion tokens and the fraction of
+        prompt tokens served from the provider's prompt cache
+    """
+    def aggregate(group: pd.DataFrame) -> pd.Series:
+        latency_ms = group['latency'] * 1000
+        prompt_tokens = group['prompt_tokens'].dropna()
+        completion_tokens = group['completion_tokens'].dropna()
+        cached_tokens = group['cached_tokens'].dropna()
+        return pd.Series({
+            'examples': len(group),
+            'accuracy': group['correct'].mean(),
+            'errors': group['error'].notna().sum(),
+            'latency_p50_ms': np.percentile(latency_ms, 50),
+            'latency_p95_ms': np.percentile(latency_ms, 95),
+            'prompt_tokens_mean': prompt_tokens.mean() if len(prompt_tokens) else np.nan,
+            'prompt_tokens_p95': np.percentile(prompt_tokens, 95) if len(prompt_tokens) else np.nan,
+            'completion_tokens_mean': completion_tokens.mean() if len(completion_tokens) else np.nan,
+            'cached_token_ratio': (cached_tokens.sum() / group.loc[cached_tokens.index, 'prompt_tokens'].sum()
+                                   if len(cached_tokens) else np.nan),
+        })
+    return results.groupby(['model', 'variant']).apply(aggregate, include_groups=False).reset_index()
+
+def confusion_matrix(results: pd.DataFrame, model: Optional[str] = None, variant: Optional[str] = None,
+                     agent_mapping: Dict[int, str] = AGENT_MAPPING) -> pd.DataFrame:
+    """
+    Count expected vs. predicted agents.
+
+    Args:
+        results: Frame returned by evaluate_routing
+        model: Optional model to restrict the matrix to
+        variant: Optional prompt variant to restrict the matrix to
+        agent_mapping: Agent ids to label rows and columns with. Failed calls
+                       appear in an 'error' column.
+
+    Returns:
+        Matrix with expected agents as rows and predicted agents as columns
+    """
+    if model is not None:
+        results = results[results['model'] == model]
+    if variant is not None:
+        results = results[results['variant'] == variant]
+    labels = list(sorted(agent_mapping))
+    predicted = results['predicted'].astype(object).where(results['predicted'].notna(), 'error')
+    matrix = pd.crosstab(results['expected'], predicted, rownames=['expected'], colnames=['predicted'])
+    columns = labels + [c for c in matrix.columns if c not in labels]
+    return matrix.reindex(index=labels, columns=columns, fill_value=0)
+
+if __name__ == '__main__':
+    import argparse
+    import os
+
+    from backend.llms import DEFAULTS, OpenAILLM
+
+    parser = argparse.ArgumentParser(description='Evaluate ConductorAgent routing accuracy and latency.')
+    parser.add_argument('dataset', help='JSON lines file of labeled conversation prefixes')
+    parser.add_argument('--models', nargs='+', default=[DEFAULTS['model']], help='OpenAI models to evaluate')
+    parser.add_argument('--variants', nargs='*', default=[],
+                        help='Prompt variants as name=path to a template file (default prompt is always included)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Maximum routing calls in flight')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='Deadline per routing call in seconds')
+    parser.add_argument('--output', help='Optional CSV path for the per-example results')
+    args = parser.parse_args()
+
+    api_key = os.environ['OPENAI_API_KEY']
+    llms = {model: OpenAILLM(api_key=api_key, model_args=dict(DEFAULTS, model=model)) for model in args.models}
+    variants = {'default': CONDUCTOR_SYSTEM_PROMPT}
+    for spec in args.variants:
+        name, path = spec.split('=', 1)
+        with open(path, encoding='utf-8') as f:
+            variants[name] = f.read()
+
+    results = evaluate_routing(load_dataset(args.dataset), llms, variants, workers=args.workers, timeout=args.timeout)
+    print(summarize(results).to_string(index=False))
+    for model in llms:
+        for variant in variants:
+            print(f"\n{model} / {variant}")
+            print(confusion_matrix(results, model, variant).to_string())
+    if args.output:
+        results.to_csv(args.output, index=False)
@@ -0,0 +1,537 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Type
+
+import openai
+import pandas as pd
+from pydantic import BaseModel
+
+from backend.llms import RETRY_STATUS_CODES, BaseLLM, CancellationToken
+from backend.agents import RUBRIC, RubricAgent, SummaryAgent
+from backend.analytics import _fingerprint, scan_exports
+
+# * ==============================================================
+# * Constants
+# * ==============================================================
+
+DEFAULT_WORKERS = 8
+
+# Prompt budget per grading call. Longer transcripts have their older turns folded
+# into a summary first. Tokens are estimated at roughly four characters each.
+MAX_PROMPT_TOKENS = 16000
+CHARS_PER_TOKEN = 4
+
+# Tokens held back for the summary of earlier turns and for the response
+SUMMARY_RESERVE = 1000
+RESPONSE_RESERVE = 1000
+
+# Default account limits shared by every worker
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200000
+
+# Retries after a transient failure (429, 408, 409, 5xx, connection errors), with
+# exponential backoff. The wrapped LLM should not retry itself, so that every
+# attempt is paced by the limiter.
+RATE_LIMIT_RETRIES = 5
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 60.0
+
+# Per-call deadline in seconds
+GRADING_TIMEOUT = 180
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+# * ==============================================================
+# * Rate Limiting
+# * ==============================================================
+
+class RateLimiter:
+    """
+    Thread-safe token buckets for requests and tokens per minute.
+
+    Every worker acquires capacity before calling the provider, so the pool as a
+    whole stays under the account limits. When the provider still rejects a call,
+    pause stops all workers until the advertised retry time has passed.
+
+    Attributes:
+        requests_per_minute_: Request budget
+        tokens_per_minute_: Token budget
+    """
+
+    def __init__(self, requests_per_minute: float = REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = TOKENS_PER_MINUTE) -> None:
+        """
+        Initialize the limiter with full buckets.
+
+        Args:
+            requests_per_minute: Request budget
+            tokens_per_minute: Token budget
+        """
+        self.requests_per_minute_ = requests_per_minute
+        self.tokens_per_minute_ = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        """Caller holds the lock."""
+        elapsed = now - self._updated
+        self._requests = min(self.requests_per_minute_, self._requests + elapsed * self.requests_per_minute_ / 60)
+        self._tokens = min(self.tokens_per_minute_, self._tokens + elapsed * self.tokens_per_minute_ / 60)
+        self._updated = now
+
+    def acquire(self, tokens: int) -> float:
+        """
+        Block until a request of the given size fits in both budgets.
+
+        Args:
+            tokens: Estimated tokens of the request (capped at the token budget)
+
+        Returns:
+            Seconds spent waiting
+        """
+        tokens = min(tokens, self.tokens_per_minute_)
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    missing_requests = 1 - self._requests
+                    missing_tokens = tokens - self._tokens
+                    if missing_requests <= 0 and missing_tokens <= 0:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        return time.monotonic() - start
+                    wait = max(missing_requests * 60 / self.requests_per_minute_,
+                               missing_tokens * 60 / self.tokens_per_minute_)
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold back every worker for a while (e.g. after a 429 response).
+
+        Args:
+            seconds: Time to wait before the next request
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+def _is_transient(e: Exception) -> bool:
+    """Whether a failed call is worth retrying."""
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in RETRY_STATUS_CODES or e.status_code >= 500
+    return isinstance(e, openai.APIConnectionError)
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """Return the provider's advertised retry delay in seconds, if any."""
+    response = getattr(e, 'response', None)
+    try:
+        return float(response.headers.get('retry-after')) if response is not None else None
+    except (TypeError, ValueError):
+        return None
+
+class RateLimitedLLM(BaseLLM):
+    """
+    Wrapper that paces calls through a RateLimiter and retries rate-limited calls.
+
+    This is the only retry layer: wrap an LLM that does not retry on its own (such
+    as an OpenAILLM built with max_retries=0), so that every attempt acquires
+    capacity from the limiter.
+
+    Attributes:
+        llm_: The wrapped LLM
+        limiter_: Limiter shared by every worker
+        max_retries_: Retries after a transient failure
+        stats_: Counters for calls, retries and seconds spent waiting for capacity
+    """
+
+    def __init__(self, llm: BaseLLM, limiter: RateLimiter, max_retries: int = RATE_LIMIT_RETRIES, **kwargs) -> None:
+        """
+        Initialize the wrapper.
+
+        Args:
+            llm: The LLM to pace
+            limiter: Limiter shared by every worker
+            max_retries: Retries after a transient failure
+            **kwargs: Additional arguments
+        """
+        self.llm_ = llm
+        self.limiter_ = limiter
+        self.max_retries_ = max_retries
+        self.model_args_ = getattr(llm, 'model_args_', {})
+        self.stats_ = {'calls': 0, 'retries': 0, 'wait_seconds': 0.0}
+        self._stats_lock = threading.Lock()
+
+    def last_usage(self) -> Optional[Dict[str, int]]:
+        """Token usage of the wrapped LLM's most recent call from the calling thread."""
+        return self.llm_.last_usage()
+
+    def _call(self, call: Callable[[], Any], prompt_tokens: int) -> Any:
+        for attempt in range(self.max_retries_ + 1):
+            waited = self.limiter_.acquire(prompt_tokens + RESPONSE_RESERVE)
+            with self._stats_lock:
+                self.stats_['calls'] += 1
+                self.stats_['wait_seconds'] += waited
+            try:
+                return call()
+            except (openai.APIStatusError, openai.APIConnectionError) as e:
+                if attempt == self.max_retries_ or not _is_transient(e):
+                    raise
+                delay = _retry_after(e) or min(BACKOFF_MAX, BACKOFF_BASE ** attempt) * (1 + random.random())
+                if isinstance(e, openai.RateLimitError):
+                    self.limiter_.pause(delay)
+                with self._stats_lock:
+                    self.stats_['retries'] += 1
+                time.sleep(delay)
+
+    @staticmethod
+    def _estimate(prompt: Any, system_prompt: Optional[str]) -> int:
+        if isinstance(prompt, str):
+            return estimate_tokens(prompt + (system_prompt or ''))
+        return sum(estimate_tokens(m.get('content') or '') for m in prompt)
+
+    def query(self, prompt: str, system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+              cancel_token: Optional[CancellationToken] = None) -> str:
+        """
+        Send a paced text query to the wrapped LLM.
+
+        Args:
+            prompt: The user's prompt
+            system_prompt: System prompt to set context
+            timeout: Optional deadline in seconds
+            cancel_token: Optional token used to abandon the call
+
+        Returns:
+            The model's response text
+        """
+        return self._call(lambda: self.llm_.query(prompt, system_prompt, timeout=timeout, cancel_token=cancel_token),
+                          self._estimate(prompt, system_prompt))
+
+    def structured_query(self, response_format: Type[BaseModel], prompt: str,
+                         system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+                         cancel_token: Optional[CancellationToken] = None) -> BaseModel:
+        """
+        Send a paced structured query to the wrapped LLM.
+
+        Args:
+            response_format: Pydantic model defining the expected response structure
+            prompt: The user's prompt
+            system_prompt: System prompt to set context
+            timeout: Optional deadline in seconds
+            cancel_token: Optional token used to abandon the call
+
+        Returns:
+            The model's response parsed into the specified Pydantic model
+        """
+        return self._call(lambda: self.llm_.structured_query(response_format, prompt, system_prompt,
+                                                             timeout=timeout, cancel_token=cancel_token),
+                          self._estimate(prompt, system_prompt))
+
+# * ==============================================================
+# * Checkpoint
+# * ==============================================================
+
+class Checkpoint:
+    """
+    Append-only JSON lines file of scored transcripts.
+
+    Each result is written and flushed as soon as its transcript is scored, so an
+    interrupted run loses at most the transcripts in flight. A transcript counts as
+    done when its latest result has no error and was scored from an export with
+    the same modification time and size. Results are keyed by the export's real
+    path, so the same export is recognized however its directory was spelled.
+
+    Attributes:
+        path_: Location of the checkpoint file
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Open a checkpoint, loading any earlier results.
+
+        Args:
+            path: Location of the checkpoint file
+        """
+        self.path_ = path
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        result = json.loads(line)
+                        self._results[os.path.realpath(result['source_file'])] = result
+
+    def done(self, path: str) -> bool:
+        """Whether an export has already been scored (or skipped) successfully in its current state."""
+        result = self._results.get(os.path.realpath(path))
+        if result is None or result.get('error') is not None:
+            return False
+        try:
+            return result.get('fingerprint') == _fingerprint(path)
+        except OSError:
+            return False
+
+    def add(self, result: Dict[str, Any]) -> None:
+        """
+        Record a result and append it to the file.
+
+        Args:
+            result: Result row with at least 'source_file'
+        """
+        with self._lock:
+            self._results[os.path.realpath(result['source_file'])] = result
+            directory = os.path.dirname(self.path_)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path_, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(result) + '\n')
+                f.flush()
+
+    def results(self) -> List[Dict[str, Any]]:
+        """Return the latest result of every export, sorted by path."""
+        with self._lock:
+            return [self._results[path] for path in sorted(self._results)]
+
+# * ==============================================================
+# * Scoring
+# * ==============================================================
+
+def chunk_turns(turns: List[Dict[str, str]], max_tokens: int) -> List[List[Dict[str, str]]]:
+    """
+    Split debate turns into consecutive chunks that fit a token budget.
+
+    Args:
+        turns: The debate messages
+        max_tokens: Estimated token budget per chunk (a single longer message gets its own chunk)
+
+    Returns:
+        List of chunks in order
+    """
+    chunks: List[List[Dict[str, str]]] = []
+    current: List[Dict[str, str]] = []
+    size = 0
+    for turn in turns:
+        tokens = estimate_tokens(turn.get('content') or '')
+        if current and size + tokens > max_tokens:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(turn)
+        size += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def score_transcript(llm: BaseLLM, path: str, rubric: Dict[str, str] = RUBRIC,
+                     max_prompt_tokens: int = MAX_PROMPT_TOKENS, timeout: Optional[float] = GRADING_TIMEOUT) -> Dict[str, Any]:
+    """
+    Score one D2L export against the rubric.
+
+    The opening assistant message is taken as the scenario. When the debate does
+    not fit the prompt budget it is chunked, and all but the last chunk are folded
+    into a running summary with the SummaryAgent before the RubricAgent grades the
+    summary and the final chunk. Exports without any student turn are skipped
+    without calling the LLM. A grade missing any rubric criterion is an error and
+    has no total.
+
+    Args:
+        llm: The language model used by the agents
+        path: Path to the export
+        rubric: Dictionary mapping criterion name to its description
+        max_prompt_tokens: Estimated prompt budget per call
+        timeout: Deadline in seconds for each call
+
+    Returns:
+        Result row with the student, one column per criterion ('score_<name>') and
+        its justification, the total score, feedback, timing, token totals, the
+        reason it was skipped (or None) and any error
+    """
+    start = time.perf_counter()
+    result: Dict[str, Any] = {'source_file': path, 'fingerprint': None,
+                              'model': getattr(llm, 'model_args_', {}).get('model'), 'skipped': None}
+    usage = {'llm_calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0}
+
+    def track() -> None:
+        usage['llm_calls'] += 1
+        for key, value in (llm.last_usage() or {}).items():
+            usage[key] = usage.get(key, 0) + (value or 0)
+
+    try:
+        result['fingerprint'] = _fingerprint(path)
+        with open(path, encoding='utf-8') as f:
+            export = json.load(f)
+        messages = export.get('messages') or []
+        result.update({
+            'username': export.get('username'),
+            'occupation': export.get('occupation') or None,
+            'topic': export.get('topic') or None,
+            'messages': len(messages),
+            'student_turns': sum(m.get('role') == 'user' for m in messages),
+        })
+        if not result['student_turns']:
+            # Nothing to grade; recorded so later runs do not pick the export up again
+            result['skipped'] = 'No student turns'
+        else:
+            scenario = None
+            if messages[0].get('role') == 'assistant':
+                scenario, messages = messages[0].get('content'), messages[1:]
+
+            rubric_agent = RubricAgent(llm=llm, rubric=rubric, timeout=timeout)
+            budget = (max_prompt_tokens - estimate_tokens(rubric_agent.system_prompt_)
+                      - estimate_tokens(scenario or '') - SUMMARY_RESERVE)
+            chunks = chunk_turns(messages, max(budget, 1)) or [[]]
+            summary = None
+            if len(chunks) > 1:
+                summary_agent = SummaryAgent(llm=llm, timeout=timeout)
+                for chunk in chunks[:-1]:
+                    summary = summary_agent.respond(chunk, summary=summary)
+                    track()
+            grade = rubric_agent.structured_respond(chunks[-1], scenario=scenario, summary=summary)
+            track()
+
+            scores = {s.criterion.strip().lower(): s for s in grade.scores}
+            for name in rubric:
+                score = scores.get(name.lower())
+                result[f'score_{name}'] = score.score if score is not None else None
+                result[f'justification_{name}'] = score.justification if score is not None else None
+            missing = [name for name in rubric if name.lower() not in scores]
+            result['total'] = float('nan') if missing else sum(result[f'score_{name}'] for name in rubric)
+            result['feedback'] = grade.feedback
+            result['chunks'] = len(chunks)
+            if missing:
+                raise ValueError(f"Grade is missing criteria: {', '.join(missing)}")
+        result['error'] = None
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result.update(usage)
+    result['seconds'] = time.perf_counter() - start
+    result['scored_at'] = time.time()
+    return result
+
+def score_exports(export_dir: str, checkpoint_path: str, llm: BaseLLM, rubric: Dict[str, str] = RUBRIC,
+                  workers: int = DEFAULT_WORKERS, max_prompt_tokens: int = MAX_PROMPT_TOKENS,
+                  on_result: Optional[Callable[[Dict[str, Any]], None]] = None) -> pd.DataFrame:
+    """
+    Score every D2L export below a directory, resuming from a checkpoint.
+
+    Exports already scored in their current state are skipped. The rest are read
+    from disk one at a time by a bounded pool of workers, so memory stays flat
+    regardless of the number of transcripts, and each result is checkpointed as
+    soon as it completes. Wrap the LLM in a RateLimitedLLM to keep the pool under
+    the provider's limits.
+
+    Args:
+        export_dir: Directory holding exported transcripts
+        checkpoint_path: JSON lines file receiving the results
+        llm: The language model used by the agents
+        rubric: Dictionary mapping criterion name to its description
+        workers: Number of transcripts scored concurrently
+        max_prompt_tokens: Estimated prompt budget per call
+        on_result: Optional callback receiving each new result
+
+    Returns:
+        Results table of every export below the directory (see results_table)
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    paths = scan_exports(export_dir)
+    pending = [p for p in paths if not checkpoint.done(p)]
+
+    def run(path: str) -> None:
+        result = score_transcript(llm, path, rubric=rubric, max_prompt_tokens=max_prompt_tokens)
+        checkpoint.add(result)
+        if on_result is not None:
+            on_result(result)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run, pending))
+
+    selected = set(paths)
+    return results_table([r for r in checkpoint.results() if os.path.realpath(r['source_file']) in selected])
+
+def results_table(results: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Build the results table from checkpointed results.
+
+    Args:
+        results: Result rows (see score_transcript)
+
+    Returns:
+        One row per export with the student, per-criterion scores and total,
+        feedback, chunk count, seconds, LLM calls, token totals, skip reason and
+        any error
+    """
+    table = pd.DataFrame(results)
+    if 'fingerprint' in table:
+        table = table.drop(columns=['fingerprint'])
+    return table
+
+def grading_summary(table: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Compute run-wide totals from a results table.
+
+    Args:
+        table: Table returned by score_exports
+
+    Returns:
+        Dictionary with the number of transcripts scored, skipped and failed, the
+        mean total score and the summed seconds, calls and tokens
+    """
+    if table.empty:
+        return {'scored': 0, 'skipped': 0, 'failed': 0}
+    failed = table['error'].notna()
+    # Checkpoints written before skipping was recorded have no such column
+    skipped = table['skipped'].notna() & ~failed if 'skipped' in table else pd.Series(False, index=table.index)
+    scored = ~failed & ~skipped
+    return {
+        'scored': int(scored.sum()),
+        'skipped': int(skipped.sum()),
+        'failed': int(failed.sum()),
+        'total_mean': float(table.loc[scored, 'total'].mean()) if scored.any() else float('nan'),
+        'seconds': float(table['seconds'].sum()),
+        'llm_calls': int(table['llm_calls'].sum()),
+        'prompt_tokens': int(table['prompt_tokens'].sum()),
+        'completion_tokens': int(table['completion_tokens'].sum()),
+        'cached_tokens': int(table['cached_tokens'].sum()),
+    }
+
+if __name__ == '__main__':
+    import argparse
+
+    from backend.llms import DEFAULTS, OpenAILLM
+
+    parser = argparse.ArgumentParser(description='Grade exported debates against the rubric.')
+    parser.add_argument('export_dir', help='Directory holding exported transcripts')
+    parser.add_argument('checkpoint', help='JSON lines file receiving results (resumed if it exists)')
+    parser.add_argument('--model', default=DEFAULTS['model'], help='OpenAI model used for grading')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Transcripts scored concurrently')
+    parser.add_argument('--rpm', type=float, default=REQUESTS_PER_MINUTE, help='Requests per minute budget')
+    parser.add_argument('--tpm', type=float, default=TOKENS_PER_MINUTE, help='Tokens per minute budget')
+    parser.add_argument('--max-prompt-tokens', type=int, default=MAX_PROMPT_TOKENS, help='Prompt budget per call')
+    parser.add_argument('--output', help='Optional CSV path for the results table')
+    args = parser.parse_args()
+
+    llm = RateLimitedLLM(
+        OpenAILLM(api_key=os.environ['OPENAI_API_KEY'], model_args=dict(DEFAULTS, model=args.model),
+                  timeout=GRADING_TIMEOUT, max_retries=0),
+        RateLimiter(requests_per_minute=args.rpm, tokens_per_minute=args.tpm))
+
+    def report(result: Dict[str, Any]) -> None:
+        status = result['error'] or (f"skipped ({result['skipped']})" if result['skipped'] else f"total {result['total']}")
+        print(f"{result['source_file']}: {status} ({result['seconds']:.1f}s)")
+
+    table = score_exports(args.export_dir, args.checkpoint, llm, workers=args.workers,
+                          max_prompt_tokens=args.max_prompt_tokens, on_result=report)
+    for key, value in grading_summary(table).items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+    if args.output:
+        table.to_csv(args.output, index=False)
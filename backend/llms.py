@@ -1,5 +1,10 @@
+import hashlib
+import random
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional, Type, Union
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Type, Union
 
 import openai
 from pydantic import BaseModel
@@ -29,6 +34,263 @@ DEFAULTS = {
     'temperature': 1,
 }
 
+# Default per-call deadline in seconds (the OpenAI client default is 10 minutes)
+DEFAULT_TIMEOUT = 60
+
+# Retries of transient failures (429, 408, 409, 5xx, connection errors) within a
+# call's deadline, with the OpenAI client's default count and backoff
+MAX_RETRIES = 2
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+RETRY_STATUS_CODES = (408, 409, 429)
+
+# Client pool limits: number of API keys kept and idle time before a client is evicted
+POOL_MAX_CLIENTS = 64
+POOL_IDLE_TTL = 15 * 60
+
+# Adaptive model selection: candidate models from best to worst quality, the latency
+# target used for agents without their own, EWMA smoothing, the error rate above
+# which a model is avoided, and how often a better model is retried once skipped
+ADAPTIVE_MODELS = ['gpt-5', 'gpt-5-mini', 'gpt-5-nano']
+DEFAULT_SLO = 20
+EWMA_ALPHA = 0.3
+MAX_ERROR_RATE = 0.25
+PROBE_INTERVAL = 60
+LATENCY_WINDOW = 50
+DECISION_LOG = 200
+
+# * ==============================================================
+# * Cancellation
+# * ==============================================================
+
+class LLMCancelledError(Exception):
+    """Raised when an LLM call is abandoned because its cancellation token fired."""
+    pass
+
+class LLMTimeoutError(TimeoutError):
+    """Raised when an LLM call does not complete before its deadline."""
+    pass
+
+class CancellationToken:
+    """
+    Thread-safe flag used to abandon in-flight LLM calls.
+
+    A token is created per unit of work (e.g. a conversation turn) and passed down
+    through the agents to the LLM. Cancelling it stops streaming responses at the
+    next chunk and prevents calls that have not started yet from being sent.
+    """
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the token has been cancelled."""
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """Cancel the token and run any registered callbacks."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """
+        Register a callback run once when the token is cancelled.
+
+        Args:
+            callback: Function called without arguments. Runs immediately if the
+                      token is already cancelled.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the token is cancelled or the timeout expires.
+
+        Args:
+            timeout: Maximum time to wait in seconds
+
+        Returns:
+            True if the token was cancelled
+        """
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self) -> None:
+        """
+        Raises:
+            LLMCancelledError: If the token has been cancelled
+        """
+        if self._event.is_set():
+            raise LLMCancelledError("The LLM call was cancelled.")
+
+# * ==============================================================
+# * Client Pool
+# * ==============================================================
+
+def hash_key(api_key: str) -> str:
+    """
+    Return a stable, non-reversible identifier for an API key.
+
+    Args:
+        api_key: The API key to hash
+
+    Returns:
+        Hex digest used to index clients without keeping keys as dictionary keys
+    """
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+class _PooledClient:
+    """An OpenAI client with its usage counters."""
+
+    def __init__(self, client: openai.OpenAI) -> None:
+        self.client = client
+        self.last_used = time.monotonic()
+        self.requests = 0
+        self.connections = 0
+
+class ClientPool:
+    """
+    Process-wide pool of OpenAI clients shared by every session using the same key.
+
+    Each client owns an HTTP connection pool, so sessions that share a key also
+    share warm TLS connections. Clients are indexed by a hash of the API key and
+    evicted when the pool is full (least recently used first) or when they have
+    been idle longer than the TTL. Evicted clients are dropped rather than closed
+    so that calls still holding them can finish; their connections are released
+    once those calls complete.
+
+    Attributes:
+        max_clients_: Maximum number of clients kept
+        idle_ttl_: Idle time in seconds after which a client is evicted
+    """
+
+    def __init__(self, max_clients: int = POOL_MAX_CLIENTS, idle_ttl: float = POOL_IDLE_TTL) -> None:
+        """
+        Initialize the pool.
+
+        Args:
+            max_clients: Maximum number of clients kept
+            idle_ttl: Idle time in seconds after which a client is evicted
+        """
+        self.max_clients_ = max_clients
+        self.idle_ttl_ = idle_ttl
+        self._clients: 'OrderedDict[str, _PooledClient]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'misses': 0, 'evictions': 0, 'prewarms': 0, 
+                        'requests': 0, 'connections': 0}
+
+    def _build(self, api_key: str) -> _PooledClient:
+        """
+        Create a client whose HTTP requests report connection setup back to the pool.
+        """
+        entry = None
+
+        def trace(event_name: str, info: Dict[str, Any]) -> None:
+            if event_name == 'connection.connect_tcp.complete':
+                with self._lock:
+                    entry.connections += 1
+                    self._counts['connections'] += 1
+
+        def on_request(request) -> None:
+            request.extensions['trace'] = trace
+            with self._lock:
+                entry.requests += 1
+                self._counts['requests'] += 1
+
+        http_client = openai.DefaultHttpxClient(event_hooks={'request': [on_request]})
+        entry = _PooledClient(openai.OpenAI(api_key=api_key, http_client=http_client))
+        return entry
+
+    def _evict(self, now: float) -> None:
+        """Drop idle clients and trim the pool to its maximum size. Caller holds the lock."""
+        for key in [k for k, e in self._clients.items() if now - e.last_used > self.idle_ttl_]:
+            del self._clients[key]
+            self._counts['evictions'] += 1
+        while len(self._clients) > self.max_clients_:
+            self._clients.popitem(last=False)
+            self._counts['evictions'] += 1
+
+    def get(self, api_key: str) -> openai.OpenAI:
+        """
+        Return the shared client for an API key, creating it on first use.
+
+        Args:
+            api_key: OpenAI API key
+
+        Returns:
+            The pooled OpenAI client
+        """
+        key = hash_key(api_key)
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                self._counts['hits'] += 1
+                self._clients.move_to_end(key)
+            else:
+                self._counts['misses'] += 1
+                entry = self._clients[key] = self._build(api_key)
+                self._evict(now)
+            entry.last_used = now
+            return entry.client
+
+    def prewarm(self, api_key: str) -> None:
+        """
+        Open a connection for an API key in the background.
+
+        Issues a cheap, unbilled request (listing models) so the TLS handshake
+        has already happened by the time the first completion is requested.
+        Failures, including an invalid key, are ignored.
+
+        Args:
+            api_key: OpenAI API key
+        """
+        client = self.get(api_key)
+        with self._lock:
+            self._counts['prewarms'] += 1
+
+        def warm() -> None:
+            try:
+                client.with_options(timeout=10, max_retries=0).models.list()
+            except Exception:
+                pass
+
+        threading.Thread(target=warm, name='ethicsbot-prewarm', daemon=True).start()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report pool size and connection reuse.
+
+        Returns:
+            Dictionary with the pool size, hit/miss/eviction/prewarm counts, the
+            number of HTTP requests and new connections, and the fraction of
+            requests served on an already open connection
+        """
+        with self._lock:
+            self._evict(time.monotonic())
+            stats: Dict[str, Any] = dict(self._counts, size=len(self._clients))
+        requests = stats['requests']
+        stats['connection_reuse'] = 1 - stats['connections'] / requests if requests else 0.0
+        return stats
+
+# Pool shared by every OpenAILLM in the process
+CLIENT_POOL = ClientPool()
+
 # * ==============================================================
 # * Abstract Base Classes
 # * ==============================================================
@@ -51,14 +313,43 @@ class BaseLLM(ABC):
         """
         pass
 
+    def for_agent(self, agent: str) -> 'BaseLLM':
+        """
+        Return the LLM an agent should use.
+
+        Implementations that adapt to the caller (see AdaptiveLLM) return a view
+        bound to the agent; the default is the LLM itself.
+
+        Args:
+            agent: Name of the agent class making the calls
+
+        Returns:
+            An LLM for the agent's calls
+        """
+        return self
+
+    def last_usage(self) -> Optional[Dict[str, int]]:
+        """
+        Token usage of the most recent call made from the calling thread.
+
+        Returns:
+            Dictionary with 'prompt_tokens', 'completion_tokens' and, where the provider
+            reports it, 'cached_tokens', or None if the implementation does not report usage
+        """
+        usage = getattr(self, '_usage', None)
+        return getattr(usage, 'value', None) if usage is not None else None
+
     @abstractmethod
-    def query(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+    def query(self, prompt: str, system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+              cancel_token: Optional[CancellationToken] = None) -> str:
         """
         Send a query to the language model and get a text response.
         
         Args:
             prompt: The user's prompt
             system_prompt: Optional system prompt to set context
+            timeout: Optional deadline for the call in seconds
+            cancel_token: Optional token used to abandon the call
             
         Returns:
             The model's response as text
@@ -67,7 +358,8 @@ class BaseLLM(ABC):
     
     @abstractmethod
     def structured_query(self, response_format: Type[BaseModel], prompt: str, 
-                         system_prompt: Optional[str] = None) -> BaseModel:
+                         system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+                         cancel_token: Optional[CancellationToken] = None) -> BaseModel:
         """
         Send a query to the language model and get a structured response.
         
@@ -75,6 +367,8 @@ class BaseLLM(ABC):
             response_format: Pydantic model defining the expected response structure
             prompt: The user's prompt
             system_prompt: Optional system prompt to set context
+            timeout: Optional deadline for the call in seconds
+            cancel_token: Optional token used to abandon the call
             
         Returns:
             The model's response parsed into the specified Pydantic model
@@ -93,12 +387,18 @@ class OpenAILLM(BaseLLM):
     It handles token counting, model validation, and both standard and structured queries.
     
     Attributes:
-        client_: OpenAI client instance
+        client_: OpenAI client shared through the client pool
         model_args_: Dictionary of model parameters
-        token_counter_: Counter for tracking token usage
+        timeout_: Default deadline in seconds applied to every call
+        max_retries_: Retries after a transient failure (0 leaves retrying to the caller)
+        stats_: Counters for issued, cancelled and timed out calls, token usage
+                (including prompt tokens served from the provider's prompt cache) and
+                the number and total seconds of completed calls with and without cache hits
     """
 
-    def __init__(self, api_key: str, model_args: Dict[str, Any] = DEFAULTS, **kwargs) -> None:
+    def __init__(self, api_key: str, model_args: Dict[str, Any] = DEFAULTS, 
+                 timeout: Optional[float] = DEFAULT_TIMEOUT, client_pool: Optional[ClientPool] = CLIENT_POOL,
+                 max_retries: int = MAX_RETRIES, **kwargs) -> None:
         """
         Initialize the OpenAI LLM.
         
@@ -108,13 +408,25 @@ class OpenAILLM(BaseLLM):
                 - model: The OpenAI model to use (e.g., 'gpt-4o', 'gpt-4-turbo')
                 - temperature: Controls randomness in responses (0.0-2.0)
                 - max_tokens: Maximum tokens in the response (optional)
+            timeout: Default deadline in seconds for each call, overridable per call
+            client_pool: Pool the client is taken from. None creates a private client.
+            max_retries: Retries after a 429, 5xx or connection error
             **kwargs: Additional arguments
             
         Raises:
             ValueError: If model is not specified or not supported
         """
-        self.client_ = openai.OpenAI(api_key=api_key)
+        self._api_key = api_key
+        self._client_pool = client_pool
+        self._private_client = openai.OpenAI(api_key=api_key) if client_pool is None else None
         self.model_args_ = model_args
+        self.timeout_ = timeout
+        self.max_retries_ = max_retries
+        self.stats_ = {'calls': 0, 'cancelled': 0, 'timed_out': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                       'cached_tokens': 0, 'cache_hit_calls': 0, 'cache_hit_seconds': 0.0,
+                       'cache_miss_calls': 0, 'cache_miss_seconds': 0.0}
+        self._stats_lock = threading.Lock()
+        self._usage = threading.local()
         
         if "model" not in model_args:
             raise ValueError("model must be specified in the model_args.")
@@ -165,26 +477,162 @@ class OpenAILLM(BaseLLM):
             
         return message
 
-    def query(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+    @property
+    def client_(self) -> openai.OpenAI:
+        """The OpenAI client, looked up in the pool on every call so evictions are respected."""
+        if self._client_pool is None:
+            return self._private_client
+        return self._client_pool.get(self._api_key)
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats_[key] += 1
+
+    def _record_usage(self, usage: Any, seconds: float) -> None:
+        """Store the usage of a completed call for last_usage and add it and its duration to stats_."""
+        if usage is None:
+            self._usage.value = None
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = (getattr(details, 'cached_tokens', None) or 0) if details is not None else 0
+        self._usage.value = {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens,
+                             'cached_tokens': cached_tokens}
+        outcome = 'cache_hit' if cached_tokens else 'cache_miss'
+        with self._stats_lock:
+            self.stats_['prompt_tokens'] += usage.prompt_tokens
+            self.stats_['completion_tokens'] += usage.completion_tokens
+            self.stats_['cached_tokens'] += cached_tokens
+            self.stats_[f'{outcome}_calls'] += 1
+            self.stats_[f'{outcome}_seconds'] += seconds
+
+    @staticmethod
+    def _retry_delay(e: Exception, attempt: int) -> Optional[float]:
+        """
+        Return the delay before retrying a failed attempt, or None if it should not be retried.
+        """
+        if isinstance(e, openai.APIStatusError):
+            if e.status_code not in RETRY_STATUS_CODES and e.status_code < 500:
+                return None
+            try:
+                retry_after = float(e.response.headers.get('retry-after'))
+                if 0 < retry_after <= 60:
+                    return retry_after
+            except (TypeError, ValueError):
+                pass
+        elif not isinstance(e, openai.APIConnectionError):
+            return None
+        delay = min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY)
+        return delay * (1 - 0.25 * random.random())
+
+    def _request(self, send: Callable[[openai.OpenAI], Any], timeout: Optional[float],
+                 cancel_token: Optional[CancellationToken]) -> Any:
+        """
+        Send a request, retrying transient failures within the deadline.
+
+        The client's own retries are replaced by this loop when a deadline is set:
+        each attempt is given only the time left before the deadline, so the
+        deadline bounds the whole call while 429, 5xx and connection errors are
+        still retried. A retry whose backoff would overrun the deadline is not made.
+        """
+        if timeout is None:
+            return send(self.client_.with_options(max_retries=self.max_retries_))
+        deadline = time.monotonic() + timeout
+        for attempt in range(self.max_retries_ + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeoutError()
+            try:
+                return send(self.client_.with_options(timeout=remaining, max_retries=0))
+            except (openai.APIStatusError, openai.APIConnectionError) as e:
+                delay = self._retry_delay(e, attempt)
+                if attempt == self.max_retries_ or delay is None or time.monotonic() + delay >= deadline:
+                    raise
+            if cancel_token is None:
+                time.sleep(delay)
+            elif cancel_token.wait(delay):
+                cancel_token.raise_if_cancelled()
+
+    def query(self, prompt: str, system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+              cancel_token: Optional[CancellationToken] = None) -> str:
         """
         Send a query to the OpenAI model and get a text response.
+
+        When a cancellation token is supplied the response is streamed so that the
+        request can be closed, and generation stopped, as soon as the token fires.
         
         Args:
             prompt: The user's prompt
             system_prompt: System prompt to set context
+            timeout: Deadline in seconds (defaults to timeout_)
+            cancel_token: Optional token used to abandon the call
             
         Returns:
             The model's response text
             
         Raises:
-            ValueError: If prompt exceeds token limit
+            LLMCancelledError: If the token is cancelled before the response completes
+            LLMTimeoutError: If the deadline passes before the response completes
         """
+        timeout = self.timeout_ if timeout is None else timeout
         message = self._build_message(prompt, system_prompt)
-        response = self.client_.chat.completions.create(messages=message, **self.model_args_)
-        return response.choices[0].message.content
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        self._count('calls')
+        self._usage.value = None
+        start = time.perf_counter()
+        try:
+            if cancel_token is None:
+                response = self._request(
+                    lambda client: client.chat.completions.create(messages=message, **self.model_args_),
+                    timeout, cancel_token)
+                self._record_usage(response.usage, time.perf_counter() - start)
+                return response.choices[0].message.content
+            return self._stream(message, timeout, cancel_token, start)
+        except LLMCancelledError:
+            self._count('cancelled')
+            raise
+        except (openai.APITimeoutError, LLMTimeoutError) as e:
+            self._count('timed_out')
+            raise LLMTimeoutError(f"The LLM call did not complete within {timeout} seconds.") from e
+
+    def _stream(self, message: List[Dict[str, str]], timeout: Optional[float], 
+                cancel_token: CancellationToken, start: float) -> str:
+        """
+        Stream a chat completion, checking the token and deadline between chunks.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Only opening the stream is retried; a failure part way through is not
+        stream = self._request(
+            lambda client: client.chat.completions.create(
+                messages=message, stream=True, stream_options={'include_usage': True}, **self.model_args_),
+            timeout, cancel_token)
+        cancel_token.add_callback(stream.close)
+        parts = []
+        usage = None
+        try:
+            for chunk in stream:
+                cancel_token.raise_if_cancelled()
+                if deadline is not None and time.monotonic() > deadline:
+                    raise LLMTimeoutError()
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                if chunk.usage is not None:
+                    usage = chunk.usage
+        except LLMCancelledError:
+            raise
+        except Exception:
+            # Closing the stream from the cancelling thread surfaces as a read error
+            cancel_token.raise_if_cancelled()
+            raise
+        finally:
+            stream.close()
+        cancel_token.raise_if_cancelled()
+        self._record_usage(usage, time.perf_counter() - start)
+        return "".join(parts)
     
     def structured_query(self, response_format: Type[BaseModel], prompt: str, 
-                         system_prompt: Optional[str] = None) -> BaseModel:
+                         system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+                         cancel_token: Optional[CancellationToken] = None) -> BaseModel:
         """
         Send a query to the OpenAI model and get a structured response.
         
@@ -192,17 +640,512 @@ class OpenAILLM(BaseLLM):
             response_format: Pydantic model defining the expected response structure
             prompt: The user's prompt
             system_prompt: System prompt to set context
+            timeout: Deadline in seconds (defaults to timeout_)
+            cancel_token: Optional token used to abandon the call
             
         Returns:
             The model's response parsed into the specified Pydantic model
             
         Raises:
-            ValueError: If prompt exceeds token limit
+            LLMCancelledError: If the token is cancelled before the response is used
+            LLMTimeoutError: If the deadline passes before the response completes
         """
+        timeout = self.timeout_ if timeout is None else timeout
         message = self._build_message(prompt, system_prompt)
-        response = self.client_.beta.chat.completions.parse(
-            messages=message,
-            response_format=response_format,
-            **self.model_args_
-        )
-        return response.choices[0].message.parsed
\ No newline at end of file
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        self._count('calls')
+        self._usage.value = None
+        start = time.perf_counter()
+        try:
+            response = self._request(
+                lambda client: client.beta.chat.completions.parse(
+                    messages=message,
+                    response_format=response_format,
+                    **self.model_args_
+                ),
+                timeout, cancel_token)
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+        except LLMCancelledError:
+            self._count('cancelled')
+            raise
+        except (openai.APITimeoutError, LLMTimeoutError) as e:
+            self._count('timed_out')
+            raise LLMTimeoutError(f"The LLM call did not complete within {timeout} seconds.") from e
+        self._record_usage(response.usage, time.perf_counter() - start)
+        return response.choices[0].message.parsed
+
+def prompt_cache_report(stats: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """
+    Summarize provider-side prompt caching from OpenAILLM counters.
+
+    Args:
+        stats: An OpenAILLM's stats_, or counters summed over several LLMs
+
+    Returns:
+        Dictionary with the fraction of prompt tokens served from the cache, the
+        fraction of calls with a cache hit, the mean seconds per call with and
+        without a hit and the difference between them (None where there is no data)
+    """
+    prompt_tokens = stats.get('prompt_tokens', 0)
+    hits, misses = stats.get('cache_hit_calls', 0), stats.get('cache_miss_calls', 0)
+    hit_seconds = stats.get('cache_hit_seconds', 0.0) / hits if hits else None
+    miss_seconds = stats.get('cache_miss_seconds', 0.0) / misses if misses else None
+    return {
+        'cached_token_ratio': stats.get('cached_tokens', 0) / prompt_tokens if prompt_tokens else None,
+        'cache_hit_rate': hits / (hits + misses) if hits + misses else None,
+        'hit_seconds_mean': hit_seconds,
+        'miss_seconds_mean': miss_seconds,
+        'latency_gain_seconds': miss_seconds - hit_seconds if hits and misses else None,
+    }
+
+# * ==============================================================
+# * Simulated
+# * ==============================================================
+
+class SimulatedLLM(BaseLLM):
+    """
+    Local stand-in for a hosted model used for load tests and offline runs.
+
+    Responses are canned and latency is drawn from a log-normal distribution, so
+    callers exercise the same timing, deadline and cancellation paths as with a
+    real provider without touching the network.
+
+    Attributes:
+        model_args_: Dictionary of model parameters (only used for reporting)
+        latency_: Median simulated latency in seconds
+        jitter_: Log-normal sigma applied to the latency
+        structured_fields_: Field values used to build structured responses
+        stats_: Counters for issued, cancelled and timed out calls
+    """
+
+    def __init__(self, model_args: Dict[str, Any] = DEFAULTS, latency: float = 0.5, jitter: float = 0.25,
+                 response: str = "This is a simulated response.",
+                 structured_fields: Optional[Dict[str, Any]] = None, seed: Optional[int] = None,
+                 **kwargs) -> None:
+        """
+        Initialize the simulated LLM.
+
+        Args:
+            model_args: Dictionary containing model configuration parameters
+            latency: Median simulated latency per call in seconds
+            jitter: Log-normal sigma applied to the latency (0 for a fixed latency)
+            response: Text returned by query
+            structured_fields: Field values passed to the response format in
+                               structured_query. Defaults to {'agent_id': 3}.
+            seed: Optional seed for the latency generator
+            **kwargs: Additional arguments (e.g. api_key) are ignored
+        """
+        self.model_args_ = model_args
+        self.latency_ = latency
+        self.jitter_ = jitter
+        self.response_ = response
+        self.structured_fields_ = structured_fields if structured_fields is not None else {'agent_id': 3}
+        self.stats_ = {'calls': 0, 'cancelled': 0, 'timed_out': 0}
+        self._stats_lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._usage = threading.local()
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats_[key] += 1
+
+    def _simulate_usage(self, prompt: Union[str, List[Dict[str, str]]], system_prompt: Optional[str], 
+                        response: str) -> None:
+        """Estimate token usage at roughly four characters per token."""
+        if isinstance(prompt, str):
+            prompt_chars = len(prompt) + len(system_prompt or '')
+        else:
+            prompt_chars = sum(len(m.get('content') or '') for m in prompt)
+        self._usage.value = {'prompt_tokens': prompt_chars // 4 + 1, 'completion_tokens': len(response) // 4 + 1}
+
+    def _wait(self, timeout: Optional[float], cancel_token: Optional[CancellationToken]) -> None:
+        """
+        Sleep for a simulated latency, honouring the deadline and cancellation token.
+        """
+        delay = self.latency_ * self._random.lognormvariate(0, self.jitter_) if self.jitter_ else self.latency_
+        self._count('calls')
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            self._count('timed_out')
+            raise LLMTimeoutError(f"The LLM call did not complete within {timeout} seconds.")
+        if cancel_token is None:
+            time.sleep(delay)
+        elif cancel_token.wait(delay):
+            self._count('cancelled')
+            cancel_token.raise_if_cancelled()
+
+    def query(self, prompt: str, system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+              cancel_token: Optional[CancellationToken] = None) -> str:
+        """
+        Return the canned response after a simulated delay.
+
+        Args:
+            prompt: The user's prompt
+            system_prompt: System prompt to set context
+            timeout: Optional deadline in seconds
+            cancel_token: Optional token used to abandon the call
+
+        Returns:
+            The canned response text
+        """
+        self._wait(timeout, cancel_token)
+        self._simulate_usage(prompt, system_prompt, self.response_)
+        return self.response_
+
+    def structured_query(self, response_format: Type[BaseModel], prompt: str, 
+                         system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+                         cancel_token: Optional[CancellationToken] = None) -> BaseModel:
+        """
+        Return a structured response built from structured_fields_ after a simulated delay.
+
+        Args:
+            response_format: Pydantic model defining the expected response structure
+            prompt: The user's prompt
+            system_prompt: System prompt to set context
+            timeout: Optional deadline in seconds
+            cancel_token: Optional token used to abandon the call
+
+        Returns:
+            An instance of response_format
+        """
+        self._wait(timeout, cancel_token)
+        response = response_format(**self.structured_fields_)
+        self._simulate_usage(prompt, system_prompt, response.model_dump_json())
+        return response
+
+# * ==============================================================
+# * Adaptive Model Selection
+# * ==============================================================
+
+class _Estimate:
+    """Rolling latency or error-rate estimate: an EWMA plus a window of recent samples."""
+
+    def __init__(self, alpha: float, window: int) -> None:
+        self.alpha = alpha
+        self.ewma: Optional[float] = None
+        self.samples: deque = deque(maxlen=window)
+        self.updated = 0.0
+
+    def add(self, value: float, now: float) -> None:
+        self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+        self.samples.append(value)
+        self.updated = now
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+class ModelSelector:
+    """
+    Picks a model per call from rolling latency and error-rate estimates.
+
+    Latency is tracked per (agent, model), since a retort takes far longer than a
+    routing decision, and errors are tracked per model. For each call the selector
+    chooses the highest-quality model whose smoothed latency meets the agent's SLO
+    and whose error rate is acceptable. Models without data are assumed to meet
+    their SLO. When nothing qualifies it falls back to the fastest healthy model.
+
+    Traffic shifts back as conditions recover: a better model that has been
+    skipped for probe_interval seconds receives the next call for that agent, so
+    its estimates are refreshed from live traffic.
+
+    Attributes:
+        models_: Candidate models from best to worst quality
+        slos_: Latency targets in seconds keyed by agent name
+        default_slo_: Latency target for agents without an entry in slos_
+        max_error_rate_: Error rate above which a model is avoided
+        probe_interval_: Seconds after which a skipped better model is retried
+    """
+
+    def __init__(self, models: List[str] = ADAPTIVE_MODELS, slos: Optional[Dict[str, float]] = None,
+                 default_slo: float = DEFAULT_SLO, alpha: float = EWMA_ALPHA,
+                 max_error_rate: float = MAX_ERROR_RATE, probe_interval: float = PROBE_INTERVAL,
+                 window: int = LATENCY_WINDOW) -> None:
+        """
+        Initialize the selector.
+
+        Args:
+            models: Candidate models from best to worst quality
+            slos: Latency targets in seconds keyed by agent name
+            default_slo: Latency target for other agents
+            alpha: EWMA smoothing factor (higher reacts faster)
+            max_error_rate: Error rate above which a model is avoided
+            probe_interval: Seconds after which a skipped better model is retried
+            window: Number of recent latencies kept for percentiles
+
+        Raises:
+            ValueError: If no models are given or a model is not supported
+        """
+        if not models:
+            raise ValueError("At least one model must be given.")
+        for model in models:
+            if model not in OPENAI_MODELS:
+                raise ValueError(f"Model {model} not supported. Please use a supported model.")
+        self.models_ = list(models)
+        self.slos_ = dict(slos or {})
+        self.default_slo_ = default_slo
+        self.max_error_rate_ = max_error_rate
+        self.probe_interval_ = probe_interval
+        self._alpha = alpha
+        self._window = window
+        self._latency: Dict[tuple, _Estimate] = {}
+        self._errors = {model: _Estimate(alpha, window) for model in self.models_}
+        self._probing: set = set()
+        self._decisions: deque = deque(maxlen=DECISION_LOG)
+        self._lock = threading.Lock()
+
+    def slo(self, agent: Optional[str]) -> float:
+        """Return the latency target in seconds for an agent."""
+        return self.slos_.get(agent, self.default_slo_)
+
+    def _latency_estimate(self, agent: Optional[str], model: str) -> _Estimate:
+        """Caller holds the lock."""
+        key = (agent, model)
+        if key not in self._latency:
+            self._latency[key] = _Estimate(self._alpha, self._window)
+        return self._latency[key]
+
+    def select(self, agent: Optional[str] = None) -> str:
+        """
+        Choose the model for an agent's next call.
+
+        Args:
+            agent: Name of the calling agent
+
+        Returns:
+            The selected model
+        """
+        slo = self.slo(agent)
+        now = time.monotonic()
+        with self._lock:
+            latency = {m: self._latency_estimate(agent, m).ewma for m in self.models_}
+            errors = {m: self._errors[m].ewma or 0.0 for m in self.models_}
+            healthy = [m for m in self.models_ if errors[m] <= self.max_error_rate_]
+            meeting = [m for m in healthy if latency[m] is None or latency[m] <= slo]
+            if meeting:
+                model, reason = meeting[0], 'slo'
+            elif healthy:
+                model, reason = min(healthy, key=lambda m: latency[m]), 'fastest'
+            else:
+                model, reason = min(self.models_, key=lambda m: errors[m]), 'least_errors'
+
+            # Give one skipped, better model a chance to show it has recovered
+            for better in self.models_[:self.models_.index(model)]:
+                key = (agent, better)
+                last_seen = max(self._latency_estimate(agent, better).updated, self._errors[better].updated)
+                if key not in self._probing and now - last_seen >= self.probe_interval_:
+                    self._probing.add(key)
+                    model, reason = better, 'probe'
+                    break
+
+            self._decisions.append({
+                'time': time.time(),
+                'agent': agent,
+                'model': model,
+                'reason': reason,
+                'slo': slo,
+                'expected_latency': latency[model],
+                'error_rate': errors[model],
+            })
+        return model
+
+    def observe(self, agent: Optional[str], model: str, latency: float, error: bool = False) -> None:
+        """
+        Record the outcome of a call.
+
+        Args:
+            agent: Name of the calling agent
+            model: Model that served the call
+            latency: Duration of the call in seconds (the deadline for timeouts)
+            error: Whether the call failed or timed out
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._probing.discard((agent, model))
+            self._latency_estimate(agent, model).add(latency, now)
+            self._errors[model].add(1.0 if error else 0.0, now)
+
+    def release(self, agent: Optional[str], model: str) -> None:
+        """
+        Forget a call that ended without an outcome (e.g. it was cancelled).
+
+        Args:
+            agent: Name of the calling agent
+            model: Model that was selected
+        """
+        with self._lock:
+            self._probing.discard((agent, model))
+
+    def estimates(self) -> Dict[str, Any]:
+        """
+        Report the current estimates.
+
+        Returns:
+            Per-model error rates and call counts, and per-agent latency EWMA, p50
+            and p95 for every model with data along with the agent's SLO
+        """
+        with self._lock:
+            models = {m: {'error_rate': e.ewma, 'samples': len(e.samples)} for m, e in self._errors.items()}
+            agents: Dict[str, Dict[str, Any]] = {}
+            for (agent, model), estimate in self._latency.items():
+                if not estimate.samples:
+                    continue
+                entry = agents.setdefault(str(agent), {'slo': self.slo(agent), 'models': {}})
+                entry['models'][model] = {
+                    'ewma': estimate.ewma,
+                    'p50': estimate.percentile(50),
+                    'p95': estimate.percentile(95),
+                    'samples': len(estimate.samples),
+                }
+        return {'models': models, 'agents': agents}
+
+    def decisions(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Return the most recent selections, oldest first.
+
+        Args:
+            limit: Maximum number of decisions returned
+
+        Returns:
+            Decisions with the agent, chosen model, reason ('slo', 'fastest',
+            'least_errors' or 'probe'), SLO and the estimates at the time
+        """
+        with self._lock:
+            decisions = list(self._decisions)
+        return decisions[-limit:] if limit else decisions
+
+class AdaptiveLLM(BaseLLM):
+    """
+    Routes each call to one of several LLMs chosen by a ModelSelector.
+
+    Agents obtain a view bound to their name through for_agent, so each call is
+    held to that agent's SLO. Every call's latency and outcome feed back into the
+    selector; cancelled calls are not counted.
+
+    Attributes:
+        llms_: The candidate LLMs keyed by model
+        selector_: Selector shared by every view
+        agent_: Agent the view is bound to, if any
+        model_args_: Model parameters of the default model
+    """
+
+    def __init__(self, llms: Dict[str, BaseLLM], selector: Optional[ModelSelector] = None,
+                 agent: Optional[str] = None, **kwargs) -> None:
+        """
+        Initialize the adaptive LLM.
+
+        Args:
+            llms: Candidate LLMs keyed by model. Must cover the selector's models.
+            selector: Selector to use. Defaults to one over the given models in order.
+            agent: Agent the calls are made for
+            **kwargs: Additional arguments
+
+        Raises:
+            ValueError: If a selector model has no LLM
+        """
+        self.selector_ = selector if selector is not None else ModelSelector(models=list(llms))
+        missing = [m for m in self.selector_.models_ if m not in llms]
+        if missing:
+            raise ValueError(f"No LLM given for models {missing}.")
+        self.llms_ = llms
+        self.agent_ = agent
+        self.model_args_ = getattr(llms[self.selector_.models_[0]], 'model_args_', {})
+        self._usage = threading.local()
+
+    def for_agent(self, agent: str) -> 'AdaptiveLLM':
+        """
+        Return a view of this LLM held to an agent's SLO.
+
+        Args:
+            agent: Name of the agent class making the calls
+
+        Returns:
+            An AdaptiveLLM sharing the LLMs and selector
+        """
+        return AdaptiveLLM(self.llms_, selector=self.selector_, agent=agent)
+
+    @property
+    def stats_(self) -> Dict[str, int]:
+        """Counters summed over the candidate LLMs."""
+        totals: Dict[str, int] = {}
+        for llm in self.llms_.values():
+            for key, value in getattr(llm, 'stats_', {}).items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _call(self, method: str, *args, timeout: Optional[float] = None,
+              cancel_token: Optional[CancellationToken] = None) -> Any:
+        """
+        Run a call on the selected LLM and report its outcome to the selector.
+        """
+        model = self.selector_.select(self.agent_)
+        llm = self.llms_[model]
+        self._usage.value = None
+        start = time.perf_counter()
+        try:
+            response = getattr(llm, method)(*args, timeout=timeout, cancel_token=cancel_token)
+        except LLMCancelledError:
+            self.selector_.release(self.agent_, model)
+            raise
+        except Exception:
+            self.selector_.observe(self.agent_, model, time.perf_counter() - start, error=True)
+            raise
+        self.selector_.observe(self.agent_, model, time.perf_counter() - start)
+        self._usage.value = llm.last_usage()
+        return response
+
+    def query(self, prompt: str, system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+              cancel_token: Optional[CancellationToken] = None) -> str:
+        """
+        Send a text query to the selected model.
+
+        Args:
+            prompt: The user's prompt
+            system_prompt: System prompt to set context
+            timeout: Optional deadline in seconds
+            cancel_token: Optional token used to abandon the call
+
+        Returns:
+            The model's response text
+        """
+        return self._call('query', prompt, system_prompt, timeout=timeout, cancel_token=cancel_token)
+
+    def structured_query(self, response_format: Type[BaseModel], prompt: str,
+                         system_prompt: Optional[str] = None, timeout: Optional[float] = None,
+                         cancel_token: Optional[CancellationToken] = None) -> BaseModel:
+        """
+        Send a structured query to the selected model.
+
+        Args:
+            response_format: Pydantic model defining the expected response structure
+            prompt: The user's prompt
+            system_prompt: System prompt to set context
+            timeout: Optional deadline in seconds
+            cancel_token: Optional token used to abandon the call
+
+        Returns:
+            The model's response parsed into the specified Pydantic model
+        """
+        return self._call('structured_query', response_format, prompt, system_prompt,
+                          timeout=timeout, cancel_token=cancel_token)
+
+def adaptive_factory(selector: ModelSelector):
+    """
+    Build an LLM factory for AgentService that adapts the model to latency.
+
+    Args:
+        selector: Selector shared by every API key, so estimates pool all traffic
+
+    Returns:
+        Callable taking an API key and model args and returning an AdaptiveLLM over
+        one pooled OpenAILLM per candidate model
+    """
+    def factory(api_key: str, model_args: Dict[str, Any]) -> AdaptiveLLM:
+        llms = {model: OpenAILLM(api_key=api_key, model_args=dict(model_args, model=model))
+                for model in selector.models_}
+        return AdaptiveLLM(llms, selector=selector)
+    return factory
@@ -0,0 +1,977 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import openai
+
+from backend.llms import (
+    BaseLLM,
+    OpenAILLM,
+    DEFAULTS,
+    CLIENT_POOL,
+    ModelSelector,
+    adaptive_factory,
+    prompt_cache_report,
+    hash_key,
+    CancellationToken,
+    LLMCancelledError,
+    LLMTimeoutError)
+from backend.utils import prompt_modifier
+from backend.agents import (
+    build_scenario_prompt,
+    ScenarioAgent,
+    UserClarificationAgent,
+    ScenarioClarificationAgent,
+    RetortAgent,
+    InjectionAttackAgent,
+    ConductorAgent,
+    SummaryAgent,
+    DEBATE_SUMMARY_NAME)
+
+# * ==============================================================
+# * Constants
+# * ==============================================================
+
+# Agent dispatch table used once the conductor has picked an agent id
+AGENT_DISPATCH = {
+    1: (UserClarificationAgent, "trying to figure out what you mean..."),
+    2: (ScenarioClarificationAgent, "trying to provide more information about the scenario..."),
+    3: (RetortAgent, "retorting..."),
+    4: (InjectionAttackAgent, "skeptical of your response..."),
+}
+
+# Agent used when the conductor returns an unknown id
+DEFAULT_AGENT_ID = 3
+
+# Per-call deadlines in seconds for each agent
+AGENT_TIMEOUTS = {
+    'ScenarioAgent': 90,
+    'ConductorAgent': 30,
+    'UserClarificationAgent': 60,
+    'ScenarioClarificationAgent': 60,
+    'RetortAgent': 90,
+    'InjectionAttackAgent': 60,
+    'SummaryAgent': 120,
+}
+
+# Latency targets in seconds used when the model is selected adaptively
+AGENT_SLOS = {
+    'ScenarioAgent': 30,
+    'ConductorAgent': 5,
+    'UserClarificationAgent': 15,
+    'ScenarioClarificationAgent': 15,
+    'RetortAgent': 20,
+    'InjectionAttackAgent': 15,
+    'SummaryAgent': 60,
+}
+
+# Number of attempts made for an agent response before giving up
+RESPONSE_ATTEMPTS = 3
+
+FALLBACK_RESPONSE = "I'm sorry, I'm having trouble responding. Please try again."
+
+# Default pool sizing
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_QUEUE = 256
+
+# Maximum number of per-key LLM wrappers kept by the service
+MAX_LLMS = 256
+
+# Rolling summary: the most recent messages are always sent verbatim, and older
+# messages are folded into the summary once at least SUMMARY_MIN_NEW have piled up
+SUMMARY_KEEP_RAW = 6
+SUMMARY_MIN_NEW = 4
+SUMMARY_WORKERS = 2
+MAX_MEMORIES = 1024
+
+# Default address for the standalone service
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Sentinel marking the end of a job's event stream
+_END = None
+
+# * ==============================================================
+# * Helpers
+# * ==============================================================
+
+def describe_error(e: Exception) -> str:
+    """
+    Map an exception raised by the pipeline to the warning shown to the student.
+
+    Args:
+        e: The exception raised while handling a job
+
+    Returns:
+        A user facing warning message
+    """
+    if isinstance(e, LLMTimeoutError):
+        return 'WARNING! EthicsBot took too long to respond, please try again'
+    elif isinstance(e, openai.AuthenticationError):
+        return 'WARNING! You have not loaded a valid API Key'
+    elif isinstance(e, openai.RateLimitError):
+        return 'WARNING! You do not have any money loaded to your API key'
+    elif isinstance(e, openai.APIConnectionError):  # Subclass of APIError, so checked first
+        return 'WARNING! The connection to the API failed'
+    elif isinstance(e, openai.APIError):
+        return 'WARNING! You have made an API error'
+    else:
+        return 'WARNING! An unknown error occurred'
+
+# * ==============================================================
+# * Debate Memory
+# * ==============================================================
+
+def _prefix_hash(messages: List[Dict[str, str]], n: int) -> str:
+    return hashlib.sha256(json.dumps(messages[:n], sort_keys=True).encode()).hexdigest()
+
+def compact_history(messages: List[Dict[str, str]], memory: Optional[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """
+    Replace the turns covered by a rolling summary with the summary itself.
+
+    Args:
+        messages: The full conversation, starting with the scenario
+        memory: Snapshot returned by DebateMemory.snapshot, or None
+
+    Returns:
+        The scenario, the summary and every message the summary does not cover
+    """
+    if memory is None:
+        return messages
+    summary = {
+        "role": "system",
+        "name": DEBATE_SUMMARY_NAME,
+        "content": "DEBATE SO FAR (summary of the earlier turns):\n" + memory['summary'],
+    }
+    return [messages[0], summary] + messages[memory['version']:]
+
+class DebateMemory:
+    """
+    Versioned rolling summaries of each session's debate.
+
+    The version of a summary is the number of messages it accounts for: it covers
+    messages[1:version], while the scenario (messages[0]) is always sent verbatim.
+    Turns only ever read the last completed summary, so they never wait on one
+    that is still being written, and a summary is only used when the messages it
+    covers match the conversation it is applied to (e.g. not after a reset).
+    Methods are called from the service loop only.
+    """
+
+    def __init__(self, keep_raw: int = SUMMARY_KEEP_RAW, min_new: int = SUMMARY_MIN_NEW,
+                 max_sessions: int = MAX_MEMORIES) -> None:
+        self.keep_raw_ = keep_raw
+        self.min_new_ = min_new
+        self.max_sessions_ = max_sessions
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+
+    def _valid(self, entry: Optional[Dict[str, Any]], messages: List[Dict[str, str]]) -> bool:
+        return (entry is not None and entry['summary'] is not None and entry['version'] <= len(messages)
+                and entry['prefix'] == _prefix_hash(messages, entry['version']))
+
+    def snapshot(self, session_id: str, messages: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+        """
+        Return the last completed summary that applies to a conversation.
+
+        Args:
+            session_id: The session the conversation belongs to
+            messages: The conversation the summary will be applied to
+
+        Returns:
+            Dictionary with 'version' and 'summary', or None
+        """
+        entry = self._entries.get(session_id)
+        if not self._valid(entry, messages):
+            return None
+        return {'version': entry['version'], 'summary': entry['summary']}
+
+    def claim(self, session_id: str, messages: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+        """
+        Reserve a summary refresh for a session if one is due.
+
+        Args:
+            session_id: The session the conversation belongs to
+            messages: The conversation including the latest reply
+
+        Returns:
+            The previous summary ('summary', None if none), its 'version' and the
+            'target' version to summarize up to, or None if no refresh is due or
+            one is already running
+        """
+        entry = self._entries.get(session_id)
+        if entry is not None and entry['pending']:
+            return None
+        previous = self.snapshot(session_id, messages) or {'version': 1, 'summary': None}
+        target = len(messages) - self.keep_raw_
+        if target - previous['version'] < self.min_new_:
+            return None
+        if entry is None:
+            entry = self._entries[session_id] = {'version': 1, 'summary': None, 'prefix': None, 'pending': False}
+            while len(self._entries) > self.max_sessions_:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(session_id)
+        entry['pending'] = True
+        return dict(previous, target=target)
+
+    def commit(self, session_id: str, messages: List[Dict[str, str]], version: int, 
+               summary: Optional[str]) -> None:
+        """
+        Publish a finished summary, or release the reservation if it failed.
+
+        Args:
+            session_id: The session the summary belongs to
+            messages: The conversation the summary was built from
+            version: Number of messages the summary accounts for
+            summary: The new summary, or None if summarization failed
+        """
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        entry['pending'] = False
+        if summary:
+            entry.update(version=version, summary=summary, prefix=_prefix_hash(messages, version))
+
+# * ==============================================================
+# * Turn Pipeline
+# * ==============================================================
+
+def run_scenario(llm: BaseLLM, job: Dict[str, Any], emit: Callable[[Dict[str, Any]], None],
+                 cancel_token: CancellationToken, timeouts: Dict[str, float] = AGENT_TIMEOUTS) -> None:
+    """
+    Generate the opening scenario for a conversation.
+
+    Args:
+        llm: The language model used by the agents
+        job: Job payload with optional 'occupation', 'topic' and 'username' keys
+        emit: Callback receiving the events produced by the turn
+        cancel_token: Token cancelled when the turn is abandoned
+        timeouts: Per-call deadlines keyed by agent class name
+    """
+    scenario = build_scenario_prompt(occupation=job.get('occupation'), topic=job.get('topic'))
+    scenario_agent = ScenarioAgent(llm=llm.for_agent('ScenarioAgent'), timeout=timeouts.get('ScenarioAgent'),
+                                   modifier=prompt_modifier(job.get('username')))
+    emit({'type': 'response', 'agent': 'ScenarioAgent', 
+          'content': scenario_agent.respond(scenario, cancel_token=cancel_token)})
+
+def run_reply(llm: BaseLLM, job: Dict[str, Any], emit: Callable[[Dict[str, Any]], None],
+              cancel_token: CancellationToken, timeouts: Dict[str, float] = AGENT_TIMEOUTS) -> None:
+    """
+    Route the student's latest message to an agent and generate its response.
+
+    Args:
+        llm: The language model used by the agents
+        job: Job payload with 'messages' and optional 'username' and 'memory'
+             (a DebateMemory snapshot) keys
+        emit: Callback receiving the events produced by the turn
+        cancel_token: Token cancelled when the turn is abandoned
+        timeouts: Per-call deadlines keyed by agent class name
+    """
+    messages = compact_history(job['messages'], job.get('memory'))
+    conductor_agent = ConductorAgent(llm=llm.for_agent('ConductorAgent'), timeout=timeouts.get('ConductorAgent'))
+    agent_id = conductor_agent.select_agent(messages=messages, cancel_token=cancel_token)
+    if agent_id not in AGENT_DISPATCH:
+        agent_id = DEFAULT_AGENT_ID
+    agent_class, agent_action = AGENT_DISPATCH[agent_id]
+    emit({'type': 'status', 'agent_id': agent_id, 'agent': agent_class.__name__, 'action': agent_action})
+
+    agent = agent_class(llm=llm.for_agent(agent_class.__name__), timeout=timeouts.get(agent_class.__name__),
+                        modifier=prompt_modifier(job.get('username')))
+
+    agent_response = None
+    for i in range(RESPONSE_ATTEMPTS):
+        try:
+            agent_response = agent.respond(messages=messages, cancel_token=cancel_token)
+            break
+        except (LLMCancelledError, LLMTimeoutError):
+            # A timed out call already used its whole deadline (and its retries)
+            raise
+        except Exception:
+            pass
+    if not agent_response:
+        agent_response = FALLBACK_RESPONSE
+    emit({'type': 'response', 'agent': agent_class.__name__, 'content': agent_response})
+
+PIPELINES = {
+    'scenario': run_scenario,
+    'reply': run_reply,
+}
+
+# * ==============================================================
+# * Turn Handle
+# * ==============================================================
+
+class TurnHandle:
+    """
+    Client side view of a submitted job.
+
+    Attributes:
+        job_id: Identifier assigned to the job by the service
+    """
+
+    def __init__(self, job_id: str, receive: Callable[[Optional[float]], Optional[Dict[str, Any]]],
+                 close: Optional[Callable[[], None]] = None) -> None:
+        """
+        Initialize the handle.
+
+        Args:
+            job_id: Identifier assigned to the job by the service
+            receive: Callable waiting up to a timeout (None for no limit) for the
+                     next event, returning None once the job has finished and
+                     raising TimeoutError when nothing arrived in time
+            close: Optional callable releasing the connection to the service
+        """
+        self.job_id = job_id
+        self._receive = receive
+        self._close = close
+
+    def next_event(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Wait for the next event of this job.
+
+        Callers that must stay responsive (e.g. a Streamlit script, which can only
+        be interrupted between calls into Streamlit) poll with a short timeout.
+
+        Args:
+            timeout: Seconds to wait, or None to wait until an event arrives
+
+        Returns:
+            The next event, or None once the job has finished
+
+        Raises:
+            TimeoutError: If no event arrived within the timeout. The event is not
+                          lost; a later call returns it.
+        """
+        return self._receive(timeout)
+
+    def events(self) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the events streamed back for this job.
+
+        Yields:
+            Event dictionaries with a 'type' of 'status', 'response', 'error',
+            'cancelled' or (for 'stats' jobs) 'stats'
+        """
+        while (event := self.next_event()) is not None:
+            yield event
+
+    def close(self) -> None:
+        """Stop listening to the job (its events are discarded)."""
+        if self._close is not None:
+            self._close()
+
+# * ==============================================================
+# * Agent Service
+# * ==============================================================
+
+class AgentService:
+    """
+    Asyncio based service running the turn pipeline on a bounded worker pool.
+
+    The service owns an event loop on a background thread. Jobs are placed on a
+    bounded queue and picked up by a fixed number of worker coroutines, which run
+    the blocking LLM calls on a dedicated thread pool. Every job gets its own
+    channel that streams events back to the caller as they are produced. A single
+    instance is meant to be shared by every session in the process, and LLM clients
+    are reused across sessions that use the same API key.
+
+    Jobs tagged with a 'session_id' supersede each other: submitting a new job for
+    a session cancels that session's outstanding job, as does cancel. After each
+    reply the session's older turns are folded into a rolling summary on a
+    separate executor, off the request path; later turns send the scenario, the
+    last completed summary and the remaining raw turns.
+
+    LLM wrappers are cached per API key hash (the raw key is never used as a
+    dictionary key). OpenAILLMs draw their HTTP clients from the process-wide
+    CLIENT_POOL, so connections are shared by every job using the same key.
+
+    Attributes:
+        workers_: Number of concurrent jobs
+        max_queue_: Maximum number of jobs waiting for a worker
+        model_args_: Model parameters used for newly created LLMs
+        timeouts_: Per-call deadlines keyed by agent class name
+        selector_: Model selector when models are chosen adaptively, otherwise None
+        stats_: Counters for submitted, completed, cancelled and timed out jobs
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_queue: int = DEFAULT_MAX_QUEUE,
+                 model_args: Dict[str, Any] = DEFAULTS, timeouts: Dict[str, float] = AGENT_TIMEOUTS,
+                 llm_factory: Optional[Callable[[str, Dict[str, Any]], BaseLLM]] = None,
+                 selector: Optional[ModelSelector] = None) -> None:
+        """
+        Initialize the service.
+
+        Args:
+            workers: Number of jobs processed concurrently
+            max_queue: Maximum number of queued jobs before submissions are rejected
+            model_args: Model parameters passed to the LLM factory
+            timeouts: Per-call deadlines in seconds keyed by agent class name
+            llm_factory: Callable building an LLM from an API key and model args.
+                         Defaults to OpenAILLM.
+            selector: Optional ModelSelector. When given (and no llm_factory is),
+                      each call goes to the best model meeting its agent's SLO.
+        """
+        self.workers_ = workers
+        self.max_queue_ = max_queue
+        self.model_args_ = model_args
+        self.timeouts_ = timeouts
+        self.selector_ = selector
+        self.stats_ = {'submitted': 0, 'completed': 0, 'cancelled': 0, 'timed_out': 0,
+                       'summaries': 0, 'summaries_failed': 0}
+        self.memory_ = DebateMemory()
+        self._tokens: Dict[str, CancellationToken] = {}
+        if llm_factory is None and selector is not None:
+            llm_factory = adaptive_factory(selector)
+        self._llm_factory = llm_factory
+        self._llms: 'OrderedDict[str, BaseLLM]' = OrderedDict()
+        self._retired_llm_stats: Dict[str, int] = {}
+        self._llms_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._summary_executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+
+    # --- lifecycle -------------------------------------------------
+
+    def start(self) -> 'AgentService':
+        """
+        Start the event loop thread and the worker pool.
+
+        Returns:
+            The running service
+        """
+        if self._thread is not None:
+            return self
+        self._executor = ThreadPoolExecutor(max_workers=self.workers_, thread_name_prefix='ethicsbot-agent')
+        self._summary_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix='ethicsbot-summary')
+        self._thread = threading.Thread(target=self._run_loop, name='ethicsbot-service', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self) -> None:
+        """Stop the worker pool and the event loop."""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._summary_executor.shutdown(wait=False, cancel_futures=True)
+        self._loop = self._thread = self._executor = self._summary_executor = None
+        self._started.clear()
+
+    def _run_loop(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue(maxsize=self.max_queue_)
+        for i in range(self.workers_):
+            self._loop.create_task(self._worker())
+        self._started.set()
+        self._loop.run_forever()
+
+        # Stopped: cancel the workers and any jobs in flight so the loop closes cleanly
+        tasks = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self._loop.close()
+
+    # --- llms ------------------------------------------------------
+
+    def get_llm(self, api_key: str) -> BaseLLM:
+        """
+        Return the LLM for an API key, creating it on first use.
+
+        Args:
+            api_key: The API key supplied with the job
+
+        Returns:
+            An LLM shared by every job using the same key
+        """
+        key = hash_key(api_key)
+        with self._llms_lock:
+            if key in self._llms:
+                self._llms.move_to_end(key)
+                return self._llms[key]
+            if self._llm_factory is None:
+                llm = OpenAILLM(api_key=api_key, model_args=self.model_args_)
+            else:
+                llm = self._llm_factory(api_key, self.model_args_)
+            self._llms[key] = llm
+            if len(self._llms) > MAX_LLMS:
+                # Keep the counters of dropped LLMs so llm_stats stays cumulative
+                _, retired = self._llms.popitem(last=False)
+                for stat, value in getattr(retired, 'stats_', {}).items():
+                    self._retired_llm_stats[stat] = self._retired_llm_stats.get(stat, 0) + value
+            return llm
+
+    def llm_stats(self) -> Dict[str, int]:
+        """
+        Sum the call counters of every LLM that exposes them.
+
+        Returns:
+            Totals of issued, cancelled and timed out LLM calls and token usage
+        """
+        with self._llms_lock:
+            totals = dict(self._retired_llm_stats)
+            llms = list(self._llms.values())
+        for llm in llms:
+            for key, value in getattr(llm, 'stats_', {}).items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def prompt_cache_stats(self) -> Dict[str, Optional[float]]:
+        """
+        Report how much of the prompt traffic was served from the provider's cache.
+
+        Returns:
+            See prompt_cache_report
+        """
+        return prompt_cache_report(self.llm_stats())
+
+    def prewarm(self, api_key: str) -> None:
+        """
+        Open a pooled connection for an API key ahead of its first job.
+
+        Args:
+            api_key: The API key the student entered
+        """
+        if self._llm_factory is None or self.selector_ is not None:
+            CLIENT_POOL.prewarm(api_key)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Report the process-wide client pool's size and connection reuse.
+
+        Returns:
+            See ClientPool.stats
+        """
+        return CLIENT_POOL.stats()
+
+    def model_selection(self, limit: Optional[int] = 20) -> Optional[Dict[str, Any]]:
+        """
+        Report the adaptive model selector's estimates and recent decisions.
+
+        Args:
+            limit: Maximum number of recent decisions included
+
+        Returns:
+            Dictionary with 'estimates' and 'decisions' (see ModelSelector), or
+            None when models are not selected adaptively
+        """
+        if self.selector_ is None:
+            return None
+        return {'estimates': self.selector_.estimates(), 'decisions': self.selector_.decisions(limit)}
+
+    def stats(self, limit: Optional[int] = 20) -> Dict[str, Any]:
+        """
+        Report what the service measures, for the profiler panel and remote clients.
+
+        Args:
+            limit: Maximum number of recent model selection decisions included
+
+        Returns:
+            JSON serializable dictionary with the job counters ('jobs'), the client
+            pool ('pool'), prompt caching ('prompt_cache') and the model selection
+            ('model_selection', None unless models are selected adaptively)
+        """
+        return {
+            'jobs': dict(self.stats_),
+            'pool': self.pool_stats(),
+            'prompt_cache': self.prompt_cache_stats(),
+            'model_selection': self.model_selection(limit),
+        }
+
+    # --- jobs ------------------------------------------------------
+
+    async def submit_async(self, job: Dict[str, Any]) -> Tuple[str, asyncio.Queue]:
+        """
+        Enqueue a job from within the service loop.
+
+        Args:
+            job: Job payload. 'kind' selects the pipeline ('scenario' or 'reply'),
+                 'api_key' selects the LLM and the optional 'session_id' ties the
+                 job to a session. A 'cancel' job cancels the session's
+                 outstanding work, a 'prewarm' job opens a connection for
+                 'api_key' and a 'stats' job answers with a single 'stats' event
+                 (see stats, 'limit' is optional) instead of running a pipeline.
+
+        Returns:
+            The job id and the channel its events are streamed to
+        """
+        job_id = str(next(self._ids))
+        channel: asyncio.Queue = asyncio.Queue()
+        if job['kind'] == 'prewarm':
+            self.prewarm(job['api_key'])
+            channel.put_nowait(_END)
+            return job_id, channel
+        if job['kind'] == 'stats':
+            channel.put_nowait({'type': 'stats', 'stats': self.stats(job.get('limit', 20))})
+            channel.put_nowait(_END)
+            return job_id, channel
+
+        session_id = job.get('session_id') or job_id
+        self.cancel_session(session_id)
+        if job['kind'] == 'cancel':
+            channel.put_nowait(_END)
+            return job_id, channel
+
+        token = CancellationToken()
+        self._tokens[session_id] = token
+        self.stats_['submitted'] += 1
+        try:
+            self._queue.put_nowait((job, channel, session_id, token))
+        except asyncio.QueueFull:
+            del self._tokens[session_id]
+            channel.put_nowait({'type': 'error', 'message': 'WARNING! EthicsBot is busy, please try again shortly'})
+            channel.put_nowait(_END)
+        return job_id, channel
+
+    def cancel_session(self, session_id: Optional[str]) -> bool:
+        """
+        Cancel the outstanding job of a session. Must run on the service loop.
+
+        Args:
+            session_id: The session whose job should be cancelled
+
+        Returns:
+            True if a job was cancelled
+        """
+        token = self._tokens.pop(session_id, None)
+        if token is None:
+            return False
+        token.cancel()
+        return True
+
+    def submit(self, job: Dict[str, Any]) -> TurnHandle:
+        """
+        Enqueue a job from any thread.
+
+        Args:
+            job: Job payload, see submit_async
+
+        Returns:
+            A handle streaming the job's events
+        """
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self.submit_async(job), self._loop)
+        job_id, channel = future.result()
+        return TurnHandle(job_id, self._receiver(channel))
+
+    def cancel(self, session_id: str) -> None:
+        """
+        Cancel the outstanding job of a session from any thread.
+
+        Args:
+            session_id: The session whose job should be cancelled
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self.cancel_session, session_id)
+
+    def _receiver(self, channel: asyncio.Queue) -> Callable[[Optional[float]], Optional[Dict[str, Any]]]:
+        # A get that times out is kept for the next call, so no event is dropped
+        pending = None
+        finished = False
+
+        def receive(timeout: Optional[float]) -> Optional[Dict[str, Any]]:
+            nonlocal pending, finished
+            if finished:
+                return None
+            if pending is None:
+                pending = asyncio.run_coroutine_threadsafe(channel.get(), self._loop)
+            event = pending.result(timeout)
+            pending = None
+            finished = event is _END
+            return None if finished else event
+        return receive
+
+    async def _worker(self) -> None:
+        while True:
+            job, channel, session_id, token = await self._queue.get()
+            try:
+                await self._process(job, channel, session_id, token)
+            finally:
+                if self._tokens.get(session_id) is token:
+                    del self._tokens[session_id]
+                channel.put_nowait(_END)
+                self._queue.task_done()
+
+    async def _process(self, job: Dict[str, Any], channel: asyncio.Queue, session_id: str,
+                       token: CancellationToken) -> None:
+        loop = asyncio.get_running_loop()
+        response = []
+        if job['kind'] == 'reply':
+            job = dict(job, memory=self.memory_.snapshot(session_id, job['messages']))
+
+        def emit(event: Dict[str, Any]) -> None:
+            if event['type'] == 'response':
+                response.append(event['content'])
+            loop.call_soon_threadsafe(channel.put_nowait, event)
+
+        def run() -> None:
+            # Jobs superseded while waiting in the queue never reach the LLM
+            token.raise_if_cancelled()
+            pipeline = PIPELINES[job['kind']]
+            pipeline(self.get_llm(job['api_key']), job, emit, token, self.timeouts_)
+
+        try:
+            await loop.run_in_executor(self._executor, run)
+            self.stats_['completed'] += 1
+            if job['kind'] == 'reply' and job.get('session_id') and response:
+                messages = job['messages'] + [{"role": "assistant", "content": response[-1]}]
+                self._schedule_summary(job['session_id'], job['api_key'], messages)
+        except LLMCancelledError:
+            self.stats_['cancelled'] += 1
+            channel.put_nowait({'type': 'cancelled'})
+        except Exception as e:
+            if isinstance(e, LLMTimeoutError):
+                self.stats_['timed_out'] += 1
+            channel.put_nowait({'type': 'error', 'message': describe_error(e)})
+        # Flush events scheduled from the executor thread before closing the channel
+        await asyncio.sleep(0)
+
+    def _schedule_summary(self, session_id: str, api_key: str, messages: List[Dict[str, str]]) -> None:
+        """
+        Start a background summary refresh for a session if one is due.
+        """
+        claim = self.memory_.claim(session_id, messages)
+        if claim is None:
+            return
+
+        def summarize() -> str:
+            agent = SummaryAgent(llm=self.get_llm(api_key).for_agent('SummaryAgent'), timeout=self.timeouts_.get('SummaryAgent'))
+            return agent.respond(messages[claim['version']:claim['target']], summary=claim['summary'])
+
+        async def refresh() -> None:
+            summary = None
+            try:
+                summary = await asyncio.get_running_loop().run_in_executor(self._summary_executor, summarize)
+                self.stats_['summaries'] += 1
+            except Exception:
+                self.stats_['summaries_failed'] += 1
+            finally:
+                self.memory_.commit(session_id, messages, claim['target'], summary)
+
+        asyncio.get_running_loop().create_task(refresh())
+
+# * ==============================================================
+# * Standalone Server
+# * ==============================================================
+
+async def _handle_connection(service: AgentService, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> None:
+    """
+    Serve a single job over a newline delimited JSON connection.
+
+    The client writes one job per connection and receives one JSON event per line
+    until the server closes the stream. A malformed job is answered with an error
+    event. A client disconnecting before its job finishes cancels the job.
+    """
+    session_id, token = None, None
+    try:
+        try:
+            job = json.loads(await reader.readline())
+            job_id, channel = await service.submit_async(job)
+        except (ValueError, KeyError, TypeError) as e:
+            writer.write((json.dumps({'type': 'error', 'message': f"Invalid job: {type(e).__name__}: {e}"}) + '\n').encode())
+            await writer.drain()
+            return
+        session_id = job.get('session_id') or job_id
+        token = service._tokens.get(session_id)
+
+        # The client sends nothing after its job, so the reader reaching EOF means it went away
+        disconnected = asyncio.ensure_future(reader.read())
+        try:
+            while True:
+                get = asyncio.ensure_future(channel.get())
+                done, _ = await asyncio.wait({get, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if get not in done:
+                    get.cancel()
+                    raise ConnectionResetError("Client disconnected.")
+                event = get.result()
+                if event is _END:
+                    break
+                writer.write((json.dumps(event) + '\n').encode())
+                await writer.drain()
+        finally:
+            disconnected.cancel()
+    except ConnectionError:
+        # Leave the session alone if a newer job has already superseded this one
+        if token is not None and service._tokens.get(session_id) is token:
+            service.cancel_session(session_id)
+    finally:
+        writer.close()
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, workers: int = DEFAULT_WORKERS,
+          max_queue: int = DEFAULT_MAX_QUEUE, adaptive_models: Optional[List[str]] = None) -> None:
+    """
+    Run an AgentService as a standalone process shared by several front ends.
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on
+        workers: Number of jobs processed concurrently
+        max_queue: Maximum number of queued jobs
+        adaptive_models: Optional candidate models, best first, selected against AGENT_SLOS
+    """
+    selector = ModelSelector(models=adaptive_models, slos=AGENT_SLOS) if adaptive_models else None
+    service = AgentService(workers=workers, max_queue=max_queue, selector=selector).start()
+
+    async def main() -> None:
+        server = await asyncio.start_server(
+            lambda r, w: _handle_connection(service, r, w), host, port)
+        async with server:
+            await server.serve_forever()
+
+    # Connections are accepted on the service's own loop so jobs share its queue
+    asyncio.run_coroutine_threadsafe(main(), service._loop).result()
+
+class RemoteAgentService:
+    """
+    Client for an AgentService running in another process (see serve).
+
+    Exposes the same submit interface as AgentService so the front end does not
+    need to know where the pipeline runs.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        self.host_ = host
+        self.port_ = port
+
+    def submit(self, job: Dict[str, Any]) -> TurnHandle:
+        """
+        Send a job to the remote service.
+
+        Args:
+            job: Job payload, see AgentService.submit_async
+
+        Returns:
+            A handle streaming the job's events
+        """
+        import socket
+        sock = socket.create_connection((self.host_, self.port_))
+        sock.sendall((json.dumps(job) + '\n').encode())
+        return TurnHandle('remote', self._receiver(sock), close=sock.close)
+
+    def cancel(self, session_id: str) -> None:
+        """
+        Cancel the outstanding job of a session on the remote service.
+
+        Args:
+            session_id: The session whose job should be cancelled
+        """
+        for event in self.submit({'kind': 'cancel', 'session_id': session_id}).events():
+            pass
+
+    def prewarm(self, api_key: str) -> None:
+        """
+        Ask the remote service to open a pooled connection for an API key.
+
+        Args:
+            api_key: The API key the student entered
+        """
+        for event in self.submit({'kind': 'prewarm', 'api_key': api_key}).events():
+            pass
+
+    def stats(self, limit: Optional[int] = 20) -> Dict[str, Any]:
+        """
+        Ask the remote service what it measures.
+
+        Args:
+            limit: Maximum number of recent model selection decisions included
+
+        Returns:
+            See AgentService.stats
+
+        Raises:
+            RuntimeError: If the service does not answer with its stats
+        """
+        for event in self.submit({'kind': 'stats', 'limit': limit}).events():
+            if event['type'] == 'stats':
+                return event['stats']
+        raise RuntimeError(f"The agent service at {self.host_}:{self.port_} did not report its stats.")
+
+    def _receiver(self, sock) -> Callable[[Optional[float]], Optional[Dict[str, Any]]]:
+        # Partial lines survive a timeout in the buffer, so no event is dropped
+        buffer = b''
+
+        def receive(timeout: Optional[float]) -> Optional[Dict[str, Any]]:
+            nonlocal buffer
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while b'\n' not in buffer:
+                if sock.fileno() == -1:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No event received in time.")
+                sock.settimeout(remaining)
+                chunk = sock.recv(65536)
+                if not chunk:
+                    sock.close()
+                    return None
+                buffer += chunk
+            line, buffer = buffer.split(b'\n', 1)
+            return json.loads(line)
+        return receive
+
+def connect(address: Optional[str] = None):
+    """
+    Return the service the front end should talk to.
+
+    Args:
+        address: 'host:port' of a standalone service. Falls back to the
+                 ETHICSBOT_SERVICE environment variable, and to an in-process
+                 service when neither is set.
+
+    An in-process service records to or replays from a cassette when
+    ETHICSBOT_CASSETTE is set, configured by ETHICSBOT_CASSETTE_MODE
+    (record/replay), ETHICSBOT_CASSETTE_MATCHING (strict/lenient) and
+    ETHICSBOT_CASSETTE_LATENCY (zero/original). Otherwise models are selected
+    adaptively against AGENT_SLOS when ETHICSBOT_ADAPTIVE_MODELS lists candidate
+    models from best to worst quality (comma separated).
+
+    Returns:
+        A RemoteAgentService or a started AgentService
+    """
+    address = address or os.environ.get('ETHICSBOT_SERVICE')
+    if address:
+        host, port = address.rsplit(':', 1)
+        return RemoteAgentService(host=host, port=int(port))
+    cassette_path = os.environ.get('ETHICSBOT_CASSETTE')
+    if cassette_path:
+        from backend.cassette import Cassette, cassette_factory
+        cassette = Cassette(cassette_path, mode=os.environ.get('ETHICSBOT_CASSETTE_MODE', 'replay'),
+                            matching=os.environ.get('ETHICSBOT_CASSETTE_MATCHING', 'strict'))
+        factory = cassette_factory(cassette, latency=os.environ.get('ETHICSBOT_CASSETTE_LATENCY', 'zero'))
+        return AgentService(llm_factory=factory).start()
+    adaptive_models = os.environ.get('ETHICSBOT_ADAPTIVE_MODELS')
+    if adaptive_models:
+        selector = ModelSelector(models=[m.strip() for m in adaptive_models.split(',')], slos=AGENT_SLOS)
+        return AgentService(selector=selector).start()
+    return AgentService().start()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the EthicsBot agent service.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE)
+    parser.add_argument('--adaptive-models', nargs='+', help='Candidate models from best to worst quality')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print the stats of the service running at --host/--port instead of starting one')
+    args = parser.parse_args()
+    if args.stats:
+        print(json.dumps(RemoteAgentService(host=args.host, port=args.port).stats(), indent=2))
+    else:
+        serve(host=args.host, port=args.port, workers=args.workers, max_queue=args.max_queue,
+              adaptive_models=args.adaptive_models)
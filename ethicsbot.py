@@ -1,25 +1,18 @@
 from datetime import datetime
 import json
 import time
+import uuid
 
 import pandas as pd
-import openai
 import streamlit as st
 
 import frontend.css as css
-from backend.llms import OpenAILLM
-from backend.utils import AVATAR, prompt_modifier
-from backend.agents import (
-    build_scenario_prompt, 
-    ScenarioAgent,
-    UserClarificationAgent, 
-    ScenarioClarificationAgent, 
-    RetortAgent, 
-    InjectionAttackAgent, 
-    ConductorAgent)
+from frontend.profiler import RerunProfile, get_history, profiling_enabled, render_panel, sampling_default
+from backend.llms import hash_key
+from backend.utils import AVATAR
+from backend.service import connect
 
 version = '1.0.6'
-MODEL = 'gpt-4-mini'
 
 # ========================================================================================================================
 # Set up pop up boxes
@@ -42,16 +35,55 @@ def get_username():
 # Establish app and session_state variables
 st.set_page_config(page_title='⚖️ EthicsBot', layout='wide')
 
+# Opt-in profiling of this rerun (see frontend/profiler.py)
+profile = RerunProfile(enabled=profiling_enabled(st.session_state.get('username')),
+                       sample=st.session_state.get('profile_sampling', sampling_default()),
+                       session_id=st.session_state.get('session_id'), state=st.session_state)
+profile.mark('service')
+
+# Agent service shared by every session in this process
+@st.cache_resource(show_spinner=False)
+def get_service():
+    return connect()
+
+service = get_service()
+
+# Seconds between checks for a rerun (new message, Reset Conversation) while waiting on the service
+POLL_INTERVAL = 0.5
+
+def wait_for_event(handle, session_id):
+    # Streamlit only interrupts the script for a rerun when the script calls into it, so the
+    # wait is split into short polls that refresh a status line. An interrupted wait cancels
+    # the session's job before the rerun proceeds, so abandoned turns stop being billed.
+    status = st.empty()
+    start = time.time()
+    try:
+        while True:
+            try:
+                event = handle.next_event(timeout=POLL_INTERVAL)
+                break
+            except TimeoutError:
+                status.caption(f"Waiting for EthicsBot... {time.time() - start:.0f}s")
+    except BaseException:
+        service.cancel(session_id)
+        handle.close()
+        raise
+    status.empty()
+    return event
+
+profile.mark('session_state')
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = str(uuid.uuid4())
 if 'api_key' not in st.session_state:
     st.session_state['api_key'] = None
 if 'username' not in st.session_state:
     st.session_state['username'] = None
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "agents" not in st.session_state:
+    st.session_state['agents'] = []
 if "user_launched_convo" not in st.session_state:
     st.session_state['user_launched_convo'] = False
-if "llm" not in st.session_state:
-    st.session_state['llm'] = None
 if "system_role" not in st.session_state:
     st.session_state['system_role'] = None
 if "start_time" not in st.session_state:
@@ -62,17 +94,26 @@ if "occupation" not in st.session_state:
     st.session_state['occupation'] = None
 if "topic" not in st.session_state:
     st.session_state['topic'] = None
+if "prewarmed_key" not in st.session_state:
+    st.session_state['prewarmed_key'] = None
 if "user_avatar" not in st.session_state:
     st.session_state['user_avatar'] = AVATAR
+if "profile_sampling" not in st.session_state:
+    st.session_state['profile_sampling'] = sampling_default()
 
 # ========================================================================================================================
 # Sidebar
+profile.mark('sidebar')
 with st.sidebar:
     # Image
     st.image('./frontend/adv logo.png', use_container_width=True)
     st.markdown(css.hide_img_fs, unsafe_allow_html=True)
     # API Key
     openaikey = st.text_input("OpenAI API Key", placeholder = "Enter your API Key")
+    # Warm a pooled connection as soon as a new key is entered
+    if openaikey != '' and st.session_state['prewarmed_key'] != hash_key(openaikey):
+        service.prewarm(openaikey)
+        st.session_state['prewarmed_key'] = hash_key(openaikey)
     # Note:
     st.write("Oh hey, just so you know, when you close the app, it will retain no memory of your API key or your documents.")
     st.write(f"Version: {version}")    
@@ -80,11 +121,13 @@ with st.sidebar:
     st.markdown(css.footer, unsafe_allow_html=True)
 
 # Check Launch Conditions =================================================================================================
+profile.mark('login')
 if st.session_state['username'] is None:
     get_username()
 
 # ========================================================================================================================
 # Build Header and inputs
+profile.mark('header')
 st.header("⚖️ ADV EthicsBot")
 occupation = st.text_input("Please input your planned occupation below (optional)", placeholder="example: AI Engineer")
 topic = st.text_input("Please input any special topic that you're interested in (optional)", placeholder="example: use of AI for financial credit approval")
@@ -92,12 +135,14 @@ col1, col2, col3, col4 = st.columns([1,1,1,3])
 
 # ========================================================================================================================
 # Export
+profile.mark('export')
 st.session_state['end_time'] = time.time()
 export_package = {
     'username': st.session_state['username'],
     'occupation': st.session_state['occupation'],
     'topic': st.session_state['topic'],
     'messages': st.session_state['messages'],
+    'agents': st.session_state['agents'],
     'start_time': st.session_state['start_time'],
     'end_time': st.session_state['end_time'],
 }
@@ -117,8 +162,11 @@ col3.download_button(
 )
 
 # Reset
+profile.mark('conversation')
 if col2.button("Reset Conversation", type='secondary'):
+    service.cancel(st.session_state['session_id'])
     st.session_state.messages = []
+    st.session_state['agents'] = []
     st.session_state['user_launched_convo'] = False
 
 # Build Conversation
@@ -132,10 +180,6 @@ if col1.button("Begin Conversation", type='primary'):
     else:
         st.session_state['api_key'] = openaikey
 
-# Create llm
-if st.session_state['llm'] is None and st.session_state['api_key'] is not None:
-    st.session_state['llm'] = OpenAILLM(api_key=st.session_state['api_key'], model = MODEL)
-
 # Begin conversation
 if viable == True or st.session_state['user_launched_convo'] == True:
 
@@ -146,102 +190,78 @@ if viable == True or st.session_state['user_launched_convo'] == True:
             # Build scenario
             st.session_state['occupation'] = occupation
             st.session_state['topic'] = topic
-            scenario = build_scenario_prompt(occupation = occupation, topic = topic)
-            try:
-                scenario_agent = ScenarioAgent(llm = st.session_state['llm'])
-                scenario_agent.system_prompt_ += prompt_modifier(st.session_state['username'])
-                scenario = scenario_agent.respond(scenario)
-                st.session_state.messages.append({"role": "assistant", "content": scenario})
-                st.session_state['user_launched_convo'] = True
-                st.session_state['start_time'] = time.time()
-
-                # Add to chat log
-                with st.chat_message("assistant", avatar = "⚖️"):
-                    st.write(scenario)       
-
-            except Exception as e:
-                # if e is openAI.AuthenticationError, then prompt user to enter API key
-                if isinstance(e, openai.AuthenticationError):
-                    st.error('WARNING! You have not loaded a valid API Key', icon="🚨")
-                if isinstance(e, openai.RateLimitError):
-                    st.error('WARNING! You do not have any money loaded to your API key', icon="🚨")
-                if isinstance(e, openai.APIError):
-                    st.error('WARNING! You have made an API error', icon="🚨")
-                if isinstance(e, openai.APIConnectionError):
-                    st.error('WARNING! The connection to the API failed', icon="🚨")
-                else:
-                    st.error('WARNING! An unknown error occurred', icon="🚨")
+            handle = service.submit({
+                'kind': 'scenario',
+                'session_id': st.session_state['session_id'],
+                'api_key': st.session_state['api_key'],
+                'username': st.session_state['username'],
+                'occupation': occupation,
+                'topic': topic,
+            })
+            events = []
+            with profile.llm_call('ScenarioAgent'):
+                while (event := wait_for_event(handle, st.session_state['session_id'])) is not None:
+                    events.append(event)
+            for event in events:
+                if event['type'] == 'error':
+                    st.error(event['message'], icon="🚨")
+                elif event['type'] == 'response':
+                    scenario = event['content']
+                    st.session_state.messages.append({"role": "assistant", "content": scenario})
+                    st.session_state['agents'].append(event['agent'])
+                    st.session_state['user_launched_convo'] = True
+                    st.session_state['start_time'] = time.time()
+
+                    # Add to chat log
+                    with st.chat_message("assistant", avatar = "⚖️"):
+                        st.write(scenario)
 
     # Enter user response into conversation
     if user_response := st.chat_input("What's your response?"):
         st.session_state.messages.append({"role": "user", "content": user_response})
+        st.session_state['agents'].append(None)
+
+        handle = service.submit({
+            'kind': 'reply',
+            'session_id': st.session_state['session_id'],
+            'api_key': st.session_state['api_key'],
+            'username': st.session_state['username'],
+            'messages': list(st.session_state.messages),
+        })
 
         # Select agent
-        try:
-            agent = None
-            conductor_agent = ConductorAgent(llm = st.session_state['llm'])
-            with st.spinner('EthicsBot is thinking...'):
-                agent_id = conductor_agent.select_agent(messages = st.session_state.messages)
-            agent_action = ''
-            if agent_id == 1:
-                agent = UserClarificationAgent(llm = st.session_state['llm'])
-                agent_action = "trying to figure out what you mean..."
-            elif agent_id == 2:
-                agent = ScenarioClarificationAgent(llm = st.session_state['llm'])
-                agent_action = "trying to provide more information about the scenario..."
-            elif agent_id == 3:
-                agent = RetortAgent(llm = st.session_state['llm'])
-                agent_action = "retorting..."
-            elif agent_id == 4:
-                agent = InjectionAttackAgent(llm = st.session_state['llm'])
-                agent_action = "skeptical of your response..."
-            else:
-                agent = RetortAgent(llm = st.session_state['llm'])
-                agent_action = "retorting..."
-
-            if agent is not None:
-                agent.system_prompt_ += prompt_modifier(st.session_state['username'])
-
-            for message in st.session_state.messages:
-                if message["role"].lower().strip() != 'system':
-                    if message["role"] == "user":
-                        use_avatar = st.session_state['user_avatar']
-                    else:
-                        use_avatar = "⚖️"
-                    with st.chat_message(message["role"], avatar=use_avatar):
-                        st.write(message["content"])
+        with st.spinner('EthicsBot is thinking...'), profile.llm_call('ConductorAgent'):
+            event = wait_for_event(handle, st.session_state['session_id'])
+
+        if event is not None and event['type'] == 'status':
+            with profile.phase('history'):
+                for message in st.session_state.messages:
+                    if message["role"].lower().strip() != 'system':
+                        if message["role"] == "user":
+                            use_avatar = st.session_state['user_avatar']
+                        else:
+                            use_avatar = "⚖️"
+                        with st.chat_message(message["role"], avatar=use_avatar):
+                            st.write(message["content"])
 
             # Generate agent response
-            with st.spinner(f'EthicsBot is {agent_action}'):
-                able_to_respond = False
-                for i in range(3):
-                    try:
-                        agent_response = agent.respond(messages = st.session_state.messages)
-                        able_to_respond = True
-                        break
-                    except:
-                        pass
-                if able_to_respond == False:
-                    agent_response = "I'm sorry, I'm having trouble responding. Please try again."
-
-                st.session_state.messages.append({"role": "assistant", "content": agent_response}) 
+            with st.spinner(f'EthicsBot is {event["action"]}'), profile.llm_call(event['agent']):
+                event = wait_for_event(handle, st.session_state['session_id'])
+        handle.close()
+
+        if event is not None and event['type'] == 'response':
+            agent_response = event['content']
+            st.session_state.messages.append({"role": "assistant", "content": agent_response})
+            st.session_state['agents'].append(event['agent'])
 
             # Add to chat log
             with st.chat_message("assistant", avatar = "⚖️"):
-                if agent_response:
-                    st.write(agent_response)
-                else:
-                    st.write("I'm sorry, I'm having trouble responding. Please try again.")
-
-        except Exception as e:
-            # if e is openAI.AuthenticationError, then prompt user to enter API key
-            if isinstance(e, openai.AuthenticationError):
-                st.error('WARNING! You have not loaded a valid API Key', icon="🚨")
-            elif isinstance(e, openai.RateLimitError):
-                st.error('WARNING! You do not have any money loaded to your API key', icon="🚨")
-            elif isinstance(e, openai.APIError):
-                st.error('WARNING! You have made an API error', icon="🚨")
-            elif isinstance(e, openai.APIConnectionError):
-                st.error('WARNING! The connection to the API failed', icon="🚨")
-            else:
-                st.error('WARNING! An unknown error occurred', icon="🚨")
\ No newline at end of file
+                st.write(agent_response)
+        elif event is not None and event['type'] == 'error':
+            st.error(event['message'], icon="🚨")
+
+# ========================================================================================================================
+# Profiler
+record = profile.finish()
+get_history().add(record)
+render_panel(record, get_history(), service.stats() if record is not None else None)
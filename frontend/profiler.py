@@ -0,0 +1,372 @@
+"""
+Opt-in per-rerun profiler for the Streamlit app.
+
+Profiling is enabled for every session by setting ETHICSBOT_PROFILE=1, or for
+the addresses listed (comma separated) in ETHICSBOT_PROFILE_ADMINS. While it is
+on, each rerun records the duration of its named phases and of every wait on an
+LLM call, and can optionally sample the script thread's stack. A breakdown is
+shown in the sidebar, and a rolling, process-wide history can be dumped to disk:
+reruns as JSON lines and sampled stacks in folded format, which flamegraph.pl,
+speedscope and similar tools read directly.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, MutableMapping, Optional
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# * ==============================================================
+# * Constants
+# * ==============================================================
+
+PROFILE_ENV = 'ETHICSBOT_PROFILE'
+ADMINS_ENV = 'ETHICSBOT_PROFILE_ADMINS'
+SAMPLE_ENV = 'ETHICSBOT_PROFILE_SAMPLE'
+DIR_ENV = 'ETHICSBOT_PROFILE_DIR'
+
+DEFAULT_DIR = './profiles'
+
+# Number of reruns kept in the rolling history
+HISTORY_SIZE = 500
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+# Session state key holding the sampler of the rerun in progress
+SAMPLER_KEY = '_profile_sampler'
+
+# * ==============================================================
+# * Enabling
+# * ==============================================================
+
+def profiling_enabled(username: Optional[str]) -> bool:
+    """
+    Decide whether the current session is profiled.
+
+    Args:
+        username: The logged in student, if any
+
+    Returns:
+        True when ETHICSBOT_PROFILE is set or the user is listed in ETHICSBOT_PROFILE_ADMINS
+    """
+    if os.environ.get(PROFILE_ENV, '').lower() in ('1', 'true', 'yes'):
+        return True
+    admins = [a.strip().lower() for a in os.environ.get(ADMINS_ENV, '').split(',') if a.strip()]
+    return username is not None and username.lower() in admins
+
+def sampling_default() -> bool:
+    """Whether stack sampling starts switched on (ETHICSBOT_PROFILE_SAMPLE)."""
+    return os.environ.get(SAMPLE_ENV, '').lower() in ('1', 'true', 'yes')
+
+# * ==============================================================
+# * Stack Sampler
+# * ==============================================================
+
+class StackSampler:
+    """
+    Samples one thread's Python stack from a background thread.
+
+    Stacks are aggregated as folded strings ('file:function;file:function', root
+    first) with their sample counts. Sampling ends when stopped or when the target
+    thread exits.
+
+    Attributes:
+        interval_: Seconds between samples
+        stacks_: Folded stack counts
+    """
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL) -> None:
+        """
+        Initialize the sampler.
+
+        Args:
+            thread_id: Identifier of the thread to sample
+            interval: Seconds between samples
+        """
+        self.interval_ = interval
+        self.stacks_: Counter = Counter()
+        self._thread_id = thread_id
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'StackSampler':
+        """Start sampling."""
+        self._thread = threading.Thread(target=self._run, name='ethicsbot-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        """
+        Stop sampling.
+
+        Returns:
+            The folded stack counts
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.stacks_
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_):
+            frames = sys._current_frames()
+            if self._thread_id not in frames:
+                return
+            frame = frames[self._thread_id]
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks_[';'.join(reversed(stack))] += 1
+
+# * ==============================================================
+# * Rerun Profile
+# * ==============================================================
+
+class RerunProfile:
+    """
+    Timings of a single script rerun.
+
+    Top-level phases are delimited with mark, which ends the current phase and
+    starts the next, so the script does not need to be re-indented. Sections
+    within them are timed with phase and recorded as 'outer/inner'. When the
+    profile is disabled every method is a no-op, so the script can be instrumented
+    unconditionally.
+
+    A rerun interrupted by st.rerun, st.stop or an error never reaches finish. Its
+    sampler is kept in the session state and stopped when the next rerun starts
+    profiling, which also discards its partial record.
+
+    Attributes:
+        enabled_: Whether anything is recorded
+        phases_: Seconds spent in each phase (accumulated when a phase repeats)
+        llm_calls_: Name and seconds of every LLM call waited on
+    """
+
+    def __init__(self, enabled: bool, sample: bool = False, session_id: Optional[str] = None,
+                 state: Optional[MutableMapping[str, Any]] = None) -> None:
+        """
+        Start profiling a rerun.
+
+        Args:
+            enabled: Whether to record anything
+            sample: Whether to sample the script thread's stack
+            session_id: Identifier of the session, stored with the record
+            state: Session state tracking the running sampler across reruns
+        """
+        self.enabled_ = enabled
+        self.phases_: Dict[str, float] = {}
+        self.llm_calls_: List[Dict[str, Any]] = []
+        self._session_id = session_id
+        self._stack: List[str] = []
+        self._start = time.perf_counter()
+        self._mark: Optional[str] = None
+        self._mark_start = self._start
+        self._state = state
+        leftover = state.pop(SAMPLER_KEY, None) if state is not None else None
+        if leftover is not None:
+            leftover.stop()
+        self._sampler = StackSampler(threading.get_ident()).start() if enabled and sample else None
+        if self._sampler is not None and state is not None:
+            state[SAMPLER_KEY] = self._sampler
+
+    def _add(self, key: str, seconds: float) -> None:
+        self.phases_[key] = self.phases_.get(key, 0.0) + seconds
+
+    def mark(self, name: Optional[str]) -> None:
+        """
+        End the current top-level phase and start the next.
+
+        Args:
+            name: Name of the phase that starts now, or None to stop timing phases
+        """
+        if not self.enabled_:
+            return
+        now = time.perf_counter()
+        if self._mark is not None:
+            self._add(self._mark, now - self._mark_start)
+        self._mark, self._mark_start = name, now
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time a named phase of the script.
+
+        Args:
+            name: Name of the phase
+        """
+        if not self.enabled_:
+            yield
+            return
+        self._stack.append(name)
+        key = '/'.join(([self._mark] if self._mark is not None else []) + self._stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(key, time.perf_counter() - start)
+            self._stack.pop()
+
+    @contextmanager
+    def llm_call(self, name: str) -> Iterator[None]:
+        """
+        Time a wait on an LLM call made by the agent service.
+
+        Args:
+            name: Name of the call (e.g. the agent producing it)
+        """
+        if not self.enabled_:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.llm_calls_.append({'name': name, 'seconds': time.perf_counter() - start})
+
+    def finish(self) -> Optional[Dict[str, Any]]:
+        """
+        Stop profiling.
+
+        Returns:
+            The rerun record with its total, phase and LLM call timings and any
+            sampled stacks, or None when disabled
+        """
+        if not self.enabled_:
+            return None
+        self.mark(None)
+        stacks = self._sampler.stop() if self._sampler is not None else Counter()
+        if self._state is not None:
+            self._state.pop(SAMPLER_KEY, None)
+        return {
+            'time': time.time(),
+            'session_id': self._session_id,
+            'total': time.perf_counter() - self._start,
+            'phases': dict(self.phases_),
+            'llm_calls': list(self.llm_calls_),
+            'stacks': dict(stacks),
+        }
+
+# * ==============================================================
+# * History
+# * ==============================================================
+
+class ProfileHistory:
+    """
+    Rolling, thread-safe history of rerun records shared by every session.
+
+    Attributes:
+        maxlen_: Number of reruns kept
+    """
+
+    def __init__(self, maxlen: int = HISTORY_SIZE) -> None:
+        self.maxlen_ = maxlen
+        self._records: Deque[Dict[str, Any]] = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def add(self, record: Optional[Dict[str, Any]]) -> None:
+        """Append a rerun record (None is ignored)."""
+        if record is None:
+            return
+        with self._lock:
+            self._records.append(record)
+
+    def records(self) -> List[Dict[str, Any]]:
+        """Return the kept records, oldest first."""
+        with self._lock:
+            return list(self._records)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Aggregate the history per phase and LLM call.
+
+        Returns:
+            One row per phase ('llm:<name>' for LLM calls, 'total' for whole reruns)
+            with the number of reruns it appeared in and mean, p50 and p95 milliseconds
+        """
+        samples: Dict[str, List[float]] = {}
+        for record in self.records():
+            samples.setdefault('total', []).append(record['total'])
+            for name, seconds in record['phases'].items():
+                samples.setdefault(name, []).append(seconds)
+            for call in record['llm_calls']:
+                samples.setdefault(f"llm:{call['name']}", []).append(call['seconds'])
+        rows = []
+        for name, values in samples.items():
+            ms = np.array(values) * 1000
+            rows.append({'phase': name, 'count': len(ms), 'mean_ms': ms.mean(),
+                         'p50_ms': np.percentile(ms, 50), 'p95_ms': np.percentile(ms, 95)})
+        return pd.DataFrame(rows, columns=['phase', 'count', 'mean_ms', 'p50_ms', 'p95_ms'])
+
+    def dump(self, directory: Optional[str] = None) -> Dict[str, str]:
+        """
+        Write the history to disk for offline analysis.
+
+        Args:
+            directory: Output directory (defaults to ETHICSBOT_PROFILE_DIR or ./profiles)
+
+        Returns:
+            Paths of the reruns file (JSON lines) and the folded stacks file
+        """
+        directory = directory or os.environ.get(DIR_ENV, DEFAULT_DIR)
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        records = self.records()
+        reruns_path = os.path.join(directory, f'reruns-{stamp}.jsonl')
+        with open(reruns_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps({k: v for k, v in record.items() if k != 'stacks'}) + '\n')
+        stacks: Counter = Counter()
+        for record in records:
+            stacks.update(record['stacks'])
+        stacks_path = os.path.join(directory, f'stacks-{stamp}.folded')
+        with open(stacks_path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return {'reruns': reruns_path, 'stacks': stacks_path}
+
+@st.cache_resource(show_spinner=False)
+def get_history() -> ProfileHistory:
+    """Return the process-wide profile history."""
+    return ProfileHistory()
+
+# * ==============================================================
+# * Panel
+# * ==============================================================
+
+def render_panel(record: Optional[Dict[str, Any]], history: ProfileHistory,
+                 service_stats: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Show the profiler breakdown in the sidebar.
+
+    Args:
+        record: The rerun that just finished
+        history: The rolling history to summarize and dump
+        service_stats: Optional agent service report (see AgentService.stats)
+    """
+    if record is None:
+        return
+    with st.sidebar.expander("Profiler", expanded=False):
+        st.write(f"Last rerun: {record['total'] * 1000:.0f} ms")
+        rows = [{'phase': name, 'ms': seconds * 1000} for name, seconds in record['phases'].items()]
+        rows += [{'phase': f"llm:{call['name']}", 'ms': call['seconds'] * 1000} for call in record['llm_calls']]
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+        st.write(f"History ({len(history.records())} reruns)")
+        st.dataframe(history.summary().round(1), hide_index=True, use_container_width=True)
+        if service_stats is not None:
+            st.write("Agent service")
+            st.json(service_stats, expanded=False)
+        st.checkbox("Sample stacks", key='profile_sampling')
+        if st.button("Dump profile"):
+            paths = history.dump()
+            st.success(f"Wrote {paths['reruns']} and {paths['stacks']}")
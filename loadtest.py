@@ -0,0 +1,320 @@
+"""
+Concurrent-user load test for the EthicsBot Streamlit app.
+
+Drives ethicsbot.py headlessly through Streamlit's AppTest with many simultaneous
+sessions. Each session logs in with an address from students.csv, enters an API
+key, starts a conversation and sends messages, while the agent service is backed
+by a latency-simulating SimulatedLLM instead of OpenAI.
+
+For each session count the report lists per-rerun latency percentiles, traced
+memory per session, total process RSS (the peak RSS where /proc is unavailable)
+and the source lines responsible for the largest memory growth since the
+previous step. Baselines are taken after a
+warm-up session, so import-time allocations are not charged to the sessions.
+
+AppTest creates a process-wide Streamlit runtime for every run, so reruns are
+driven one at a time: the rerun latencies measure the script under a growing
+number of live sessions, not under concurrent load. All sessions stay alive
+between steps, so state, cache and service growth accumulate as they would in a
+single server process.
+
+Concurrent load is measured in a second phase at each step: in a separate
+process, the same number of simulated students run their turns simultaneously
+against an agent service with the same configuration, contending for its worker
+pool and queue. The report gives per-turn latency percentiles and the number of
+failed turns for it. Running it in its own process keeps it out of the memory
+figures of the first phase.
+
+Usage:
+    python loadtest.py --sessions 1 10 50 100 200 --messages 2 --latency 0.2
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import backend.service as service_module
+from backend.llms import SimulatedLLM
+
+APP_FILE = 'ethicsbot.py'
+LOGIN_LABEL = 'Please input your Marquette email address below'
+API_KEY = 'sk-loadtest'
+
+# Without /proc (e.g. on macOS) only the peak RSS is available, so rows say which one they report
+RSS_IS_PEAK = not os.path.exists('/proc/self/statm')
+
+# * ==============================================================
+# * Helpers
+# * ==============================================================
+
+def rss_mb() -> float:
+    """Return the current resident set size of the process in MB, or the peak where RSS_IS_PEAK."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 2**20
+    except OSError:
+        # ru_maxrss is reported in bytes on macOS and in KiB elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Return p50/p90/p99/max of a list of latencies in milliseconds."""
+    if not values:
+        return {'p50': float('nan'), 'p90': float('nan'), 'p99': float('nan'), 'max': float('nan')}
+    ms = np.array(values) * 1000
+    return {
+        'p50': float(np.percentile(ms, 50)),
+        'p90': float(np.percentile(ms, 90)),
+        'p99': float(np.percentile(ms, 99)),
+        'max': float(ms.max()),
+    }
+
+def top_growth(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, limit: int = 5) -> List[str]:
+    """Return the source lines with the largest allocation growth between two snapshots."""
+    stats = after.compare_to(before, 'lineno')
+    return [f"{s.size_diff / 1024:+.1f} KiB {s.traceback[0].filename}:{s.traceback[0].lineno}"
+            for s in stats[:limit] if s.size_diff > 0]
+
+# * ==============================================================
+# * Simulated Session
+# * ==============================================================
+
+class Session:
+    """
+    A single simulated student driving the app through AppTest.
+
+    Attributes:
+        username: Address used to log in
+        app: The AppTest instance holding the session's state
+        latencies: Wall-clock duration of every rerun in seconds
+    """
+
+    def __init__(self, username: str, timeout: float) -> None:
+        self.username = username
+        self.app = AppTest.from_file(APP_FILE, default_timeout=timeout)
+        self.latencies: List[float] = []
+
+    def _run(self) -> None:
+        start = time.perf_counter()
+        self.app.run()
+        self.latencies.append(time.perf_counter() - start)
+        if self.app.exception:
+            raise RuntimeError(f"{self.username}: {self.app.exception[0].message}")
+
+    def _button(self, label: str):
+        return next(b for b in self.app.button if b.label == label)
+
+    def start(self) -> None:
+        """Load the app, log in, enter an API key and begin a conversation."""
+        self._run()
+        if not any(t.label == LOGIN_LABEL for t in self.app.text_input):
+            raise RuntimeError(f"{self.username}: login dialog was not shown")
+        # AppTest keeps the dialog's widgets in its element tree after the dialog calls
+        # st.rerun, which breaks later runs, so log in the way the Submit button does
+        self.app.session_state['username'] = self.username
+        self.app.sidebar.text_input[0].input(API_KEY)
+        self._button('Begin Conversation').click()
+        self._run()
+
+    def send(self, text: str) -> None:
+        """Send a chat message and wait for the agent's response."""
+        self.app.chat_input[0].set_value(text)
+        self._run()
+
+# * ==============================================================
+# * Concurrent Service Load
+# * ==============================================================
+
+def concurrent_round(sessions: int, messages: int, students: List[str],
+                     latency: float, jitter: float, workers: int) -> Dict[str, Any]:
+    """
+    Run simulated students simultaneously against a fresh agent service.
+
+    Each student requests a scenario and then sends messages, waiting for every
+    turn to finish as the app does. Meant to run in a child process (see
+    concurrent_process).
+
+    Args:
+        sessions: Number of simultaneous students
+        messages: Messages sent by every student after the scenario
+        students: Addresses to log in with
+        latency: Median simulated LLM latency in seconds
+        jitter: Log-normal sigma of the simulated latency
+        workers: Size of the agent service's worker pool
+
+    Returns:
+        Turn latencies in seconds and the number of failed turns
+    """
+    use_simulated_llm(latency, jitter, workers)
+    service = service_module.connect()
+
+    def student(i: int) -> Tuple[List[float], int]:
+        job = {'session_id': f'concurrent-{i}', 'api_key': API_KEY, 'username': students[i % len(students)]}
+        history: List[Dict[str, str]] = []
+        latencies, errors = [], 0
+        for turn in range(messages + 1):
+            if turn == 0:
+                request = dict(job, kind='scenario')
+            else:
+                history.append({"role": "user", "content": f"My position is option {turn}."})
+                request = dict(job, kind='reply', messages=list(history))
+            start = time.perf_counter()
+            events = list(service.submit(request).events())
+            latencies.append(time.perf_counter() - start)
+            responses = [e['content'] for e in events if e['type'] == 'response']
+            if responses:
+                history.append({"role": "assistant", "content": responses[-1]})
+            else:
+                errors += 1
+        return latencies, errors
+
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(student, range(sessions)))
+    return {'latencies': [l for latencies, _ in results for l in latencies],
+            'errors': sum(errors for _, errors in results)}
+
+def concurrent_process(*args: Any) -> Dict[str, Any]:
+    """
+    Run concurrent_round in a fresh interpreter and return its result.
+
+    AppTest replaces __main__ with the app script, so multiprocessing cannot
+    start a child from this module; a plain subprocess imports it instead.
+    """
+    code = f"import json, loadtest; print(json.dumps(loadtest.concurrent_round(*json.loads({json.dumps(args)!r}))))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+# * ==============================================================
+# * Load Test
+# * ==============================================================
+
+def use_simulated_llm(latency: float, jitter: float, workers: int) -> None:
+    """
+    Point the app's agent service at a SimulatedLLM.
+
+    ethicsbot.py looks up backend.service.connect on every rerun, so replacing it
+    (and clearing the cached service) swaps the backend for all sessions.
+    """
+    def connect(address: Optional[str] = None) -> service_module.AgentService:
+        return service_module.AgentService(
+            workers=workers,
+            llm_factory=lambda api_key, model_args: SimulatedLLM(model_args=model_args, latency=latency, jitter=jitter)
+        ).start()
+
+    service_module.connect = connect
+    st.cache_resource.clear()
+
+def run(steps: List[int], messages: int, latency: float, jitter: float,
+        workers: int, timeout: float) -> List[Dict[str, Any]]:
+    """
+    Grow the number of live sessions through each step and measure every round.
+
+    Args:
+        steps: Session counts to measure, in increasing order
+        messages: Messages sent by every session at each step
+        latency: Median simulated LLM latency in seconds
+        jitter: Log-normal sigma of the simulated latency
+        workers: Size of the agent service's worker pool
+        timeout: Per-rerun timeout passed to AppTest
+
+    Returns:
+        One result row per step
+    """
+    use_simulated_llm(latency, jitter, workers)
+    students = [s.lower() for s in pd.read_csv('./students.csv', header=None)[0]]
+
+    # Warm up imports, caches and the Streamlit runtime before taking baselines
+    warmup = Session(students[0], timeout)
+    warmup.start()
+    warmup.send("Warm-up message.")
+    del warmup
+
+    tracemalloc.start()
+    baseline_traced = tracemalloc.get_traced_memory()[0]
+    baseline_rss = rss_mb()
+    snapshot = tracemalloc.take_snapshot()
+
+    sessions: List[Session] = []
+    results = []
+    for step in steps:
+        new = [Session(students[i % len(students)], timeout) for i in range(len(sessions), step)]
+        for session in new:
+            session.start()
+        startup_latencies = [l for s in new for l in s.latencies]
+        sessions.extend(new)
+
+        marks = [len(s.latencies) for s in sessions]
+        for i in range(messages):
+            for session in sessions:
+                session.send(f"My position is option {i}, because it minimizes harm to the most people.")
+        rerun_latencies = [l for s, m in zip(sessions, marks) for l in s.latencies[m:]]
+
+        traced = tracemalloc.get_traced_memory()[0] - baseline_traced
+        current = tracemalloc.take_snapshot()
+        rss = rss_mb()
+
+        concurrent = concurrent_process(step, messages, students, latency, jitter, workers)
+        results.append({
+            'sessions': step,
+            'reruns': len(rerun_latencies),
+            **{f'rerun_{k}_ms': v for k, v in percentiles(rerun_latencies).items()},
+            'startup_p50_ms': percentiles(startup_latencies)['p50'],
+            **{f'concurrent_{k}_ms': v for k, v in percentiles(concurrent['latencies']).items()},
+            'concurrent_errors': concurrent['errors'],
+            'traced_per_session_kb': traced / step / 1024,
+            'rss_mb': rss,
+            'rss_peak': RSS_IS_PEAK,
+            'rss_growth_mb': rss - baseline_rss,
+            'top_growth': top_growth(snapshot, current),
+        })
+        snapshot = current
+        print_row(results[-1])
+    tracemalloc.stop()
+    return results
+
+def print_row(row: Dict[str, Any]) -> None:
+    """Print a single step of the report."""
+    print(f"sessions={row['sessions']:>4}  reruns={row['reruns']:>5}  "
+          f"p50={row['rerun_p50_ms']:.0f}ms  p90={row['rerun_p90_ms']:.0f}ms  "
+          f"p99={row['rerun_p99_ms']:.0f}ms  max={row['rerun_max_ms']:.0f}ms  "
+          f"mem/session={row['traced_per_session_kb']:.0f}KiB  "
+          f"{'peak rss' if row.get('rss_peak') else 'rss'}={row['rss_mb']:.0f}MB ({row['rss_growth_mb']:+.0f}MB)")
+    print(f"    concurrent turns: p50={row['concurrent_p50_ms']:.0f}ms  p90={row['concurrent_p90_ms']:.0f}ms  "
+          f"p99={row['concurrent_p99_ms']:.0f}ms  max={row['concurrent_max_ms']:.0f}ms  "
+          f"errors={row['concurrent_errors']}")
+    for line in row['top_growth']:
+        print(f"    {line}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the EthicsBot app with simulated users.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 10, 50, 100, 200],
+                        help='Session counts to measure, in increasing order')
+    parser.add_argument('--messages', type=int, default=2, help='Messages sent per session at each step')
+    parser.add_argument('--latency', type=float, default=0.2, help='Median simulated LLM latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.25, help='Log-normal sigma of the simulated latency')
+    parser.add_argument('--workers', type=int, default=service_module.DEFAULT_WORKERS,
+                        help='Agent service worker pool size')
+    parser.add_argument('--timeout', type=float, default=120, help='Per-rerun timeout in seconds')
+    parser.add_argument('--output', help='Optional path to write the results as JSON')
+    args = parser.parse_args()
+
+    print("Rerun latencies are measured one rerun at a time (AppTest cannot run sessions concurrently); "
+          "concurrent turn latencies come from simultaneous students driving the agent service.")
+    results = run(sorted(args.sessions), args.messages, args.latency, args.jitter,
+                  args.workers, args.timeout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
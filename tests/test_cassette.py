@@ -0,0 +1,93 @@
+from typing import Any, Dict, List
+
+import pytest
+
+from backend.cassette import Cassette, CassetteLLM, CassetteMissError
+from backend.llms import SimulatedLLM
+from backend.service import AgentService
+
+API_KEY = 'sk-test'
+
+class EchoLLM(SimulatedLLM):
+    """SimulatedLLM whose responses depend on the agent and the student's last message."""
+
+    def query(self, prompt, system_prompt=None, timeout=None, cancel_token=None):
+        super().query(prompt, system_prompt, timeout=timeout, cancel_token=cancel_token)
+        if isinstance(prompt, str):
+            return f"{system_prompt} <- {prompt}"
+        users = [m['content'] for m in prompt if m['role'] == 'user']
+        return f"{prompt[0]['content'][:40]} <- {users[-1] if users else ''}"
+
+def run_debate(service: AgentService, replies: List[str]) -> List[Dict[str, Any]]:
+    """Play a scenario and the given student replies, returning the final event of every turn."""
+    job = {'session_id': 'debate', 'api_key': API_KEY, 'username': 'student@marquette.edu'}
+    history: List[Dict[str, str]] = []
+    finals = []
+    for reply in [None] + replies:
+        if reply is None:
+            request = dict(job, kind='scenario')
+        else:
+            history.append({"role": "user", "content": reply})
+            request = dict(job, kind='reply', messages=list(history))
+        events = list(service.submit(request).events())
+        final = events[-1]
+        finals.append({k: final.get(k) for k in ('type', 'agent', 'content')})
+        if final['type'] == 'response':
+            history.append({"role": "assistant", "content": final['content']})
+    return finals
+
+def test_replays_recorded_debate(tmp_path):
+    path = str(tmp_path / 'debate.jsonl.gz')
+    replies = ["I would report the defect.", "Because safety outweighs the cost."]
+
+    recorder = Cassette(path, mode='record')
+    recording_llms = []
+
+    def record_factory(api_key, model_args):
+        llm = CassetteLLM(recorder, llm=EchoLLM(model_args=model_args, latency=0, jitter=0))
+        recording_llms.append(llm)
+        return llm
+
+    service = AgentService(workers=2, llm_factory=record_factory).start()
+    try:
+        recorded = run_debate(service, replies)
+    finally:
+        service.stop()
+    assert all(turn['type'] == 'response' for turn in recorded)
+    assert sum(llm.stats_['recorded'] for llm in recording_llms) == len(recorder.interactions_) > 0
+
+    player = Cassette(path, mode='replay')
+    replaying_llms = []
+
+    def replay_factory(api_key, model_args):
+        llm = CassetteLLM(player)
+        replaying_llms.append(llm)
+        return llm
+
+    service = AgentService(workers=2, llm_factory=replay_factory).start()
+    try:
+        replayed = run_debate(service, replies)
+    finally:
+        service.stop()
+    assert replayed == recorded
+    assert sum(llm.stats_['replayed'] for llm in replaying_llms) == len(player.interactions_)
+
+def test_strict_replay_misses_changed_request(tmp_path):
+    path = str(tmp_path / 'strict.jsonl')
+    CassetteLLM(Cassette(path, mode='record'), llm=EchoLLM(latency=0, jitter=0)).query("hello", "Agent A")
+
+    llm = CassetteLLM(Cassette(path, mode='replay'))
+    with pytest.raises(CassetteMissError):
+        llm.query("goodbye", "Agent A")
+
+def test_lenient_replay_stays_within_agent(tmp_path):
+    path = str(tmp_path / 'lenient.jsonl')
+    recorder = CassetteLLM(Cassette(path, mode='record'), llm=EchoLLM(latency=0, jitter=0))
+    recorder.query("first", "Agent A")
+    recorder.query("first", "Agent B")
+
+    llm = CassetteLLM(Cassette(path, mode='replay', matching='lenient'))
+    assert llm.query("changed", "Agent B") == "Agent B <- first"
+    assert llm.query("changed", "Agent A") == "Agent A <- first"
+    with pytest.raises(CassetteMissError):
+        llm.query("changed", "Agent C")